@@ -1,10 +1,9 @@
-from openai import OpenAI
 import json
 from tqdm import tqdm
 import argparse
 import os
 import sys
-from utils import print_response, print_log_cost, load_accumulated_cost, save_accumulated_cost
+from utils import ArtifactStream, stream_chat_completion, cal_cost, get_checkpoint_key, run_with_checkpoint, print_response, print_log_cost, print_log_cache_summary, load_accumulated_cost, save_accumulated_cost, load_paper_content, get_openai_client
 
 parser = argparse.ArgumentParser()
 
@@ -14,10 +13,11 @@ parser.add_argument('--paper_format',type=str, default="JSON", choices=["JSON",
 parser.add_argument('--pdf_json_path', type=str) # json format
 parser.add_argument('--pdf_latex_path', type=str) # latex format
 parser.add_argument('--output_dir',type=str, default="")
+parser.add_argument('--stream', action='store_true') # write responses to the artifacts as they arrive
 
 args    = parser.parse_args()
 
-client = OpenAI(api_key = os.environ["OPENAI_API_KEY"])
+client = get_openai_client()
 
 paper_name = args.paper_name
 gpt_version = args.gpt_version
@@ -28,11 +28,9 @@ output_dir = args.output_dir
 
 
 if paper_format == "JSON":
-    with open(f'{pdf_json_path}') as f:
-        paper_content = json.load(f)
+    paper_content = load_paper_content(pdf_json_path, paper_format)
 elif paper_format == "LaTeX":
-    with open(f'{pdf_latex_path}') as f:
-        paper_content = f.read()
+    paper_content = load_paper_content(pdf_latex_path, paper_format)
 else:
     print(f"[ERROR] Invalid paper format. Please select either 'JSON' or 'LaTeX.")
     sys.exit(0)
@@ -213,24 +211,25 @@ training:
 """
     }]
 
-def api_call(msg, gpt_version):
+def api_call(msg, gpt_version, stream_path=None):
+    request = {"model": gpt_version, "messages": msg}
     if "o3-mini" in gpt_version:
-        completion = client.chat.completions.create(
-            model=gpt_version, 
-            reasoning_effort="high",
-            messages=msg
-        )
-    else:
-        completion = client.chat.completions.create(
-            model=gpt_version, 
-            messages=msg
-        )
-
-    return completion 
+        request["reasoning_effort"] = "high"
+    if stream_path:
+        # written as tokens arrive, so a crash mid-generation keeps what was generated
+        with ArtifactStream(stream_path) as stream:
+            return stream_chat_completion(client, request, stream.write)
+    completion = client.chat.completions.create(**request)
+    return json.loads(completion.model_dump_json())
 
 responses = []
 trajectories = []
-total_accumulated_cost = 0
+completion_json_lst = []
+# the other stages' costs; this stage's entry is rebuilt from its resumed and new calls
+other_stage_cost = load_accumulated_cost(f"{output_dir}/accumulated_cost.json", exclude_stage="planning")
+total_accumulated_cost = other_stage_cost
+
+os.makedirs(output_dir, exist_ok=True)
 
 for idx, instruction_msg in enumerate([plan_msg, file_list_msg, task_list_msg, config_msg]):
     current_stage = ""
@@ -246,25 +245,32 @@ for idx, instruction_msg in enumerate([plan_msg, file_list_msg, task_list_msg, c
 
     trajectories.extend(instruction_msg)
 
-    completion = api_call(trajectories, gpt_version)
-    
-    # response
-    completion_json = json.loads(completion.model_dump_json())
+    # each turn is keyed by the whole conversation so far, so a rerun resumes after the last finished turn
+    checkpoint_key = get_checkpoint_key(gpt_version, trajectories)
+    stream_path = f"{output_dir}/planning_artifacts/1.{idx + 1}_response_stream.txt" if args.stream else None
+    completion_json, is_resumed = run_with_checkpoint(output_dir, checkpoint_key, lambda: api_call(trajectories, gpt_version, stream_path))
 
     # print and logging
     print_response(completion_json)
-    temp_total_accumulated_cost = print_log_cost(completion_json, gpt_version, current_stage, output_dir, total_accumulated_cost)
-    total_accumulated_cost = temp_total_accumulated_cost
+    if is_resumed:
+        # paid for in an earlier run: keep it in the accumulated total without logging a new call
+        total_accumulated_cost += cal_cost(completion_json, gpt_version)['total_cost']
+        print(f"[RESUMED] {current_stage}")
+    else:
+        temp_total_accumulated_cost = print_log_cost(completion_json, gpt_version, current_stage, output_dir, total_accumulated_cost)
+        total_accumulated_cost = temp_total_accumulated_cost
+        completion_json_lst.append(completion_json)
 
     responses.append(completion_json)
 
     # trajectories
-    message = completion.choices[0].message
-    trajectories.append({'role': message.role, 'content': message.content})
+    message = completion_json['choices'][0]['message']
+    trajectories.append({'role': message['role'], 'content': message['content']})
 
 
 # save
-save_accumulated_cost(f"{output_dir}/accumulated_cost.json", total_accumulated_cost)
+print_log_cache_summary(completion_json_lst, "[Planning]", output_dir)
+save_accumulated_cost(f"{output_dir}/accumulated_cost.json", "planning", total_accumulated_cost - other_stage_cost)
 
 os.makedirs(output_dir, exist_ok=True)
 
@@ -2,9 +2,7 @@ import json
 import argparse
 import os
 import sys
-from utils import print_response
-from transformers import AutoTokenizer
-from vllm import LLM, SamplingParams
+from utils import get_checkpoint_key, run_batch_with_checkpoint, print_response, load_paper_content, load_vllm_engine
 
 parser = argparse.ArgumentParser()
 
@@ -35,11 +33,9 @@ max_model_len = args.max_model_len
 temperature = args.temperature
 
 if paper_format == "JSON":
-    with open(f'{pdf_json_path}') as f:
-        paper_content = json.load(f)
+    paper_content = load_paper_content(pdf_json_path, paper_format)
 elif paper_format == "LaTeX":
-    with open(f'{pdf_latex_path}') as f:
-        paper_content = f.read()
+    paper_content = load_paper_content(pdf_latex_path, paper_format)
 else:
     print(f"[ERROR] Invalid paper format. Please select either 'JSON' or 'LaTeX.")
     sys.exit(0)
@@ -221,37 +217,23 @@ training:
     }]
 
 
-model_name = args.model_name
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-
-if "Qwen" in model_name:
-    llm = LLM(model=model_name, 
-            tensor_parallel_size=tp_size, 
-            max_model_len=max_model_len,
-            gpu_memory_utilization=0.95,
-            trust_remote_code=True, enforce_eager=True, 
-            rope_scaling={"factor": 4.0, "original_max_position_embeddings": 32768, "type": "yarn"})
-    sampling_params = SamplingParams(temperature=temperature, max_tokens=131072)
-
-elif "deepseek" in model_name:
-    llm = LLM(model=model_name, 
-              tensor_parallel_size=tp_size, 
-              max_model_len=max_model_len,
-              gpu_memory_utilization=0.95,
-              trust_remote_code=True, enforce_eager=True)
-    sampling_params = SamplingParams(temperature=temperature, max_tokens=128000, stop_token_ids=[tokenizer.eos_token_id])
+tokenizer, llm, sampling_params = load_vllm_engine(model_name, tp_size, max_model_len, temperature)
 
 
-def run_llm(msg):
+def generate_batch(msg_lst):
     # vllm
-    prompt_token_ids = [tokenizer.apply_chat_template(messages, add_generation_prompt=True) for messages in [msg]]
+    prompt_token_ids = [tokenizer.apply_chat_template(messages, add_generation_prompt=True) for messages in msg_lst]
 
     outputs = llm.generate(prompt_token_ids=prompt_token_ids, sampling_params=sampling_params)
 
     completion = [output.outputs[0].text for output in outputs]
     
-    return completion[0] 
+    return completion
+
+def run_llm(msg):
+    # each turn is keyed by the whole conversation so far, so a rerun resumes after the last finished turn
+    checkpoint_key = get_checkpoint_key(model_name, msg, temperature=temperature)
+    return run_batch_with_checkpoint(output_dir, [checkpoint_key], [msg], generate_batch)[0]
 
 responses = []
 trajectories = []
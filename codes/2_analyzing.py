@@ -1,10 +1,10 @@
-from openai import OpenAI
 import json
 import os
 from tqdm import tqdm
 import sys
-from utils import extract_planning, content_to_json, print_response, print_log_cost, load_accumulated_cost, save_accumulated_cost
+from utils import ArtifactStream, stream_chat_completion, cal_cost, get_checkpoint_key, run_with_checkpoint, extract_planning, content_to_json, print_response, print_log_cost, load_accumulated_cost, save_accumulated_cost, print_log_cache_summary, load_paper_content, get_openai_client
 import copy
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import argparse
 
@@ -16,10 +16,12 @@ parser.add_argument('--paper_format',type=str, default="JSON", choices=["JSON",
 parser.add_argument('--pdf_json_path', type=str) # json format
 parser.add_argument('--pdf_latex_path', type=str) # latex format
 parser.add_argument('--output_dir',type=str, default="")
+parser.add_argument('--max_concurrency',type=int, default=1) # number of files analyzed in parallel
+parser.add_argument('--stream', action='store_true') # write responses to the artifacts as they arrive
 
 args    = parser.parse_args()
 
-client = OpenAI(api_key = os.environ["OPENAI_API_KEY"])
+client = get_openai_client()
 
 paper_name = args.paper_name
 gpt_version = args.gpt_version
@@ -27,13 +29,12 @@ paper_format = args.paper_format
 pdf_json_path = args.pdf_json_path
 pdf_latex_path = args.pdf_latex_path
 output_dir = args.output_dir
+max_concurrency = max(1, args.max_concurrency)
     
 if paper_format == "JSON":
-    with open(f'{pdf_json_path}') as f:
-        paper_content = json.load(f)
+    paper_content = load_paper_content(pdf_json_path, paper_format)
 elif paper_format == "LaTeX":
-    with open(f'{pdf_latex_path}') as f:
-        paper_content = f.read()
+    paper_content = load_paper_content(pdf_latex_path, paper_format)
 else:
     print(f"[ERROR] Invalid paper format. Please select either 'JSON' or 'LaTeX.")
     sys.exit(0)
@@ -91,13 +92,9 @@ This analysis must align precisely with the paper’s methodology, experimental
      
 """}]
 
-def get_write_msg(todo_file_name, todo_file_desc):
-    
-    draft_desc = f"Write the logic analysis in '{todo_file_name}', which is intended for '{todo_file_desc}'."
-    if len(todo_file_desc.strip()) == 0:
-        draft_desc = f"Write the logic analysis in '{todo_file_name}'."
-
-    write_msg=[{'role': 'user', "content": f"""## Paper
+# Shared by every file and built once, so each request starts with the same bytes and
+# the provider's prompt cache can reuse it. Per-file text only comes after it.
+shared_context = f"""## Paper
 {paper_content}
 
 -----
@@ -127,7 +124,15 @@ def get_write_msg(todo_file_name, todo_file_desc):
 Conduct a Logic Analysis to assist in writing the code, based on the paper, the plan, the design, the task and the previously specified configuration file (config.yaml). 
 You DON'T need to provide the actual code yet; focus on a thorough, clear analysis.
 
-{draft_desc}
+"""
+
+def get_write_msg(todo_file_name, todo_file_desc):
+    
+    draft_desc = f"Write the logic analysis in '{todo_file_name}', which is intended for '{todo_file_desc}'."
+    if len(todo_file_desc.strip()) == 0:
+        draft_desc = f"Write the logic analysis in '{todo_file_name}'."
+
+    write_msg=[{'role': 'user', "content": shared_context + f"""{draft_desc}
 
 -----
 
@@ -135,69 +140,97 @@ You DON'T need to provide the actual code yet; focus on a thorough, clear analys
     return write_msg
 
 
-def api_call(msg):
+def api_call(msg, todo_file_name):
+    request = {"model": gpt_version, "messages": msg}
     if "o3-mini" in gpt_version:
-        completion = client.chat.completions.create(
-            model=gpt_version, 
-            reasoning_effort="high",
-            messages=msg
-        )
-    else:
-        completion = client.chat.completions.create(
-            model=gpt_version, 
-            messages=msg
-        )
-    return completion
+        request["reasoning_effort"] = "high"
+    if args.stream:
+        # the artifact fills in as tokens arrive and is rewritten from the final completion
+        with ArtifactStream(f'{artifact_output_dir}/{todo_file_name}_simple_analysis.txt') as stream:
+            return stream_chat_completion(client, request, stream.write)
+    completion = client.chat.completions.create(**request)
+    return json.loads(completion.model_dump_json())
+
+
+def run_analysis(todo_file_name):
+    # each file only depends on the shared planning context, so this is safe to run concurrently
+    trajectories = copy.deepcopy(analysis_msg)
+
+    instruction_msg = get_write_msg(todo_file_name, logic_analysis_dict[todo_file_name])
+    trajectories.extend(instruction_msg)
+
+    # keyed by model + full prompt (paper, plan, config, template), so a rerun skips finished files
+    checkpoint_key = get_checkpoint_key(gpt_version, trajectories)
+    completion_json, is_resumed = run_with_checkpoint(output_dir, checkpoint_key, lambda: api_call(trajectories, todo_file_name))
+    return trajectories, completion_json, is_resumed
 
 
 artifact_output_dir=f'{output_dir}/analyzing_artifacts'
 os.makedirs(artifact_output_dir, exist_ok=True)
 
-total_accumulated_cost = load_accumulated_cost(f"{output_dir}/accumulated_cost.json")
-for todo_file_name in tqdm(todo_file_lst):
-    responses = []
-    trajectories = copy.deepcopy(analysis_msg)
-
-    current_stage=f"[ANALYSIS] {todo_file_name}"
-    print(current_stage)
+analysis_file_lst = []
+for todo_file_name in todo_file_lst:
     if todo_file_name == "config.yaml":
         continue
-    
+
     if todo_file_name not in logic_analysis_dict:
         # print(f"[DEBUG ANALYSIS] {paper_name} {todo_file_name} is not exist in the logic analysis")
         logic_analysis_dict[todo_file_name] = ""
-        
-    instruction_msg = get_write_msg(todo_file_name, logic_analysis_dict[todo_file_name])
-    trajectories.extend(instruction_msg)
-        
-    completion = api_call(trajectories)
-    
-    # response
-    completion_json = json.loads(completion.model_dump_json())
-    responses.append(completion_json)
-    
-    # trajectories
-    message = completion.choices[0].message
-    trajectories.append({'role': message.role, 'content': message.content})
 
-    # print and logging
-    print_response(completion_json)
-    temp_total_accumulated_cost = print_log_cost(completion_json, gpt_version, current_stage, output_dir, total_accumulated_cost)
-    total_accumulated_cost = temp_total_accumulated_cost
+    analysis_file_lst.append(todo_file_name)
+
+# the other stages' costs; this stage's entry is rebuilt from its resumed and new calls
+other_stage_cost = load_accumulated_cost(f"{output_dir}/accumulated_cost.json", exclude_stage="analyzing")
+total_accumulated_cost = other_stage_cost
+completion_json_lst = []
+with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+    # the first request writes the shared prefix to the provider's prompt cache; the others then reuse it
+    futures = [executor.submit(run_analysis, todo_file_name) for todo_file_name in analysis_file_lst[:1]]
+    if max_concurrency > 1:
+        wait(futures)
+    futures += [executor.submit(run_analysis, todo_file_name) for todo_file_name in analysis_file_lst[1:]]
+
+    # results are consumed in task list order so logs and artifacts match the sequential run
+    for todo_file_name, future in zip(analysis_file_lst, tqdm(futures)):
+        responses = []
+
+        current_stage=f"[ANALYSIS] {todo_file_name}"
+        print(current_stage)
+
+        trajectories, completion_json, is_resumed = future.result()
+
+        # response
+        responses.append(completion_json)
+
+        # trajectories
+        message = completion_json['choices'][0]['message']
+        trajectories.append({'role': message['role'], 'content': message['content']})
+
+        # print and logging
+        print_response(completion_json)
+        if is_resumed:
+            # paid for in an earlier run: keep it in the accumulated total without logging a new call
+            total_accumulated_cost += cal_cost(completion_json, gpt_version)['total_cost']
+            print(f"[RESUMED] {current_stage}")
+        else:
+            temp_total_accumulated_cost = print_log_cost(completion_json, gpt_version, current_stage, output_dir, total_accumulated_cost)
+            total_accumulated_cost = temp_total_accumulated_cost
+            completion_json_lst.append(completion_json)
 
-    # save
-    with open(f'{artifact_output_dir}/{todo_file_name}_simple_analysis.txt', 'w') as f:
-        f.write(completion_json['choices'][0]['message']['content'])
+        # save
+        with open(f'{artifact_output_dir}/{todo_file_name}_simple_analysis.txt', 'w') as f:
+            f.write(completion_json['choices'][0]['message']['content'])
 
 
-    done_file_lst.append(todo_file_name)
+        done_file_lst.append(todo_file_name)
 
-    # save for next stage(coding)
-    todo_file_name = todo_file_name.replace("/", "_") 
-    with open(f'{output_dir}/{todo_file_name}_simple_analysis_response.json', 'w') as f:
-        json.dump(responses, f)
+        # save for next stage(coding)
+        todo_file_name = todo_file_name.replace("/", "_") 
+        with open(f'{output_dir}/{todo_file_name}_simple_analysis_response.json', 'w') as f:
+            json.dump(responses, f)
 
-    with open(f'{output_dir}/{todo_file_name}_simple_analysis_trajectories.json', 'w') as f:
-        json.dump(trajectories, f)
+        with open(f'{output_dir}/{todo_file_name}_simple_analysis_trajectories.json', 'w') as f:
+            json.dump(trajectories, f)
 
-save_accumulated_cost(f"{output_dir}/accumulated_cost.json", total_accumulated_cost)
+print_log_cache_summary(completion_json_lst, "[ANALYSIS]", output_dir)
+save_accumulated_cost(f"{output_dir}/accumulated_cost.json", "analyzing", total_accumulated_cost - other_stage_cost)
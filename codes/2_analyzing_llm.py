@@ -1,11 +1,9 @@
 import json
 import os
 from tqdm import tqdm
-from utils import extract_planning, content_to_json, print_response
+from utils import get_checkpoint_key, run_batch_with_checkpoint, extract_planning, content_to_json, print_response, load_paper_content, load_vllm_engine
 import copy
 import sys
-from transformers import AutoTokenizer
-from vllm import LLM, SamplingParams
 
 import argparse
 
@@ -23,6 +21,7 @@ parser.add_argument('--pdf_json_path', type=str) # json format
 parser.add_argument('--pdf_latex_path', type=str) # latex format
 
 parser.add_argument('--output_dir',type=str, default="")
+parser.add_argument('--batch_generation', action='store_true') # submit every file's analysis in one llm.generate call
 
 args    = parser.parse_args()
 
@@ -38,13 +37,12 @@ pdf_json_path = args.pdf_json_path
 pdf_latex_path = args.pdf_latex_path
 
 output_dir = args.output_dir
+batch_generation = args.batch_generation
     
 if paper_format == "JSON":
-    with open(f'{pdf_json_path}') as f:
-        paper_content = json.load(f)
+    paper_content = load_paper_content(pdf_json_path, paper_format)
 elif paper_format == "LaTeX":
-    with open(f'{pdf_latex_path}') as f:
-        paper_content = f.read()
+    paper_content = load_paper_content(pdf_latex_path, paper_format)
 else:
     print(f"[ERROR] Invalid paper format. Please select either 'JSON' or 'LaTeX.")
     sys.exit(0)
@@ -146,58 +144,30 @@ You DON'T need to provide the actual code yet; focus on a thorough, clear analys
 
 
 
-model_name = args.model_name
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-
-if "Qwen" in model_name:
-    llm = LLM(model=model_name, 
-            tensor_parallel_size=tp_size, 
-            max_model_len=max_model_len,
-            gpu_memory_utilization=0.95,
-            trust_remote_code=True, enforce_eager=True, 
-            rope_scaling={"factor": 4.0, "original_max_position_embeddings": 32768, "type": "yarn"})
-    sampling_params = SamplingParams(temperature=temperature, max_tokens=131072)
-
-elif "deepseek" in model_name:
-    llm = LLM(model=model_name, 
-              tensor_parallel_size=tp_size, 
-              max_model_len=max_model_len,
-              gpu_memory_utilization=0.95,
-              trust_remote_code=True, enforce_eager=True)
-    sampling_params = SamplingParams(temperature=temperature, max_tokens=128000, stop_token_ids=[tokenizer.eos_token_id])
+tokenizer, llm, sampling_params = load_vllm_engine(model_name, tp_size, max_model_len, temperature)
 
-def run_llm(msg):
+def generate_batch(msg_lst):
     # vllm
-    prompt_token_ids = [tokenizer.apply_chat_template(messages, add_generation_prompt=True) for messages in [msg]]
+    prompt_token_ids = [tokenizer.apply_chat_template(messages, add_generation_prompt=True) for messages in msg_lst]
 
     outputs = llm.generate(prompt_token_ids=prompt_token_ids, sampling_params=sampling_params)
 
+    # outputs are returned in the order of the prompts
     completion = [output.outputs[0].text for output in outputs]
     
-    return completion[0]
+    return completion
 
-artifact_output_dir=f'{output_dir}/analyzing_artifacts'
-os.makedirs(artifact_output_dir, exist_ok=True)
+def run_llm_batch(msg_lst):
+    # keyed by model + temperature + full prompt, so a rerun only generates the unfinished files
+    checkpoint_key_lst = [get_checkpoint_key(model_name, msg, temperature=temperature) for msg in msg_lst]
+    return run_batch_with_checkpoint(output_dir, checkpoint_key_lst, msg_lst, generate_batch)
+
+def run_llm(msg):
+    return run_llm_batch([msg])[0]
 
-for todo_file_name in tqdm(todo_file_lst):
+def save_analysis(todo_file_name, trajectories, completion):
     responses = []
-    trajectories = copy.deepcopy(analysis_msg)
 
-    current_stage=f"[ANALYSIS] {todo_file_name}"
-    print(current_stage)
-    if todo_file_name == "config.yaml":
-        continue
-    
-    if todo_file_name not in logic_analysis_dict:
-        # print(f"[DEBUG ANALYSIS] {paper_name} {todo_file_name} is not exist in the logic analysis")
-        logic_analysis_dict[todo_file_name] = ""
-        
-    instruction_msg = get_write_msg(todo_file_name, logic_analysis_dict[todo_file_name])
-    trajectories.extend(instruction_msg)
-        
-    completion = run_llm(trajectories)
-    
     # response
     completion_json = {
         'text': completion
@@ -225,3 +195,39 @@ for todo_file_name in tqdm(todo_file_lst):
 
     with open(f'{output_dir}/{todo_file_name}_simple_analysis_trajectories.json', 'w', encoding='utf-8') as f:
         json.dump(trajectories, f)
+
+artifact_output_dir=f'{output_dir}/analyzing_artifacts'
+os.makedirs(artifact_output_dir, exist_ok=True)
+
+# the analysis of a file only depends on the planning output, so every prompt can be built up front
+analysis_file_lst = []
+trajectories_lst = []
+for todo_file_name in todo_file_lst:
+    if todo_file_name == "config.yaml":
+        continue
+    
+    if todo_file_name not in logic_analysis_dict:
+        # print(f"[DEBUG ANALYSIS] {paper_name} {todo_file_name} is not exist in the logic analysis")
+        logic_analysis_dict[todo_file_name] = ""
+        
+    trajectories = copy.deepcopy(analysis_msg)
+    instruction_msg = get_write_msg(todo_file_name, logic_analysis_dict[todo_file_name])
+    trajectories.extend(instruction_msg)
+
+    analysis_file_lst.append(todo_file_name)
+    trajectories_lst.append(trajectories)
+
+if batch_generation:
+    print(f"[ANALYSIS] {len(analysis_file_lst)} files in one batch")
+    completion_lst = run_llm_batch(trajectories_lst)
+
+    for todo_file_name, trajectories, completion in zip(analysis_file_lst, trajectories_lst, completion_lst):
+        print(f"[ANALYSIS] {todo_file_name}")
+        save_analysis(todo_file_name, trajectories, completion)
+else:
+    for todo_file_name, trajectories in zip(tqdm(analysis_file_lst), trajectories_lst):
+        current_stage=f"[ANALYSIS] {todo_file_name}"
+        print(current_stage)
+
+        completion = run_llm(trajectories)
+        save_analysis(todo_file_name, trajectories, completion)
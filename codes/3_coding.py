@@ -1,11 +1,11 @@
-from openai import OpenAI
 import json
 import os
 from tqdm import tqdm
 import re
 import sys
 import copy
-from utils import extract_planning, content_to_json, extract_code_from_content, print_response, print_log_cost, load_accumulated_cost, save_accumulated_cost
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils import ArtifactStream, stream_chat_completion, cal_cost, get_checkpoint_key, run_with_checkpoint, extract_planning, content_to_json, extract_code_from_content, print_response, print_log_cost, load_accumulated_cost, save_accumulated_cost, print_log_cache_summary, build_dependency_graph, load_generated_code, extract_design_relations, select_code_context, code_to_stub, load_paper_content, get_openai_client
 import argparse
 
 parser = argparse.ArgumentParser()
@@ -17,9 +17,12 @@ parser.add_argument('--pdf_json_path', type=str) # json format
 parser.add_argument('--pdf_latex_path', type=str) # latex format
 parser.add_argument('--output_dir',type=str, default="")
 parser.add_argument('--output_repo_dir',type=str, default="")
+parser.add_argument('--code_context',type=str, default="all", choices=["all", "relevant", "stub"]) # relevant: full code only for the files the target uses, stub: interfaces only
+parser.add_argument('--max_concurrency',type=int, default=1) # number of files generated in parallel
+parser.add_argument('--stream', action='store_true') # write responses to the artifacts as they arrive
 
 args    = parser.parse_args()
-client = OpenAI(api_key = os.environ["OPENAI_API_KEY"])
+client = get_openai_client()
 
 paper_name = args.paper_name
 gpt_version = args.gpt_version
@@ -28,13 +31,13 @@ pdf_json_path = args.pdf_json_path
 pdf_latex_path = args.pdf_latex_path
 output_dir = args.output_dir
 output_repo_dir = args.output_repo_dir
+code_context = args.code_context
+max_concurrency = max(1, args.max_concurrency)
 
 if paper_format == "JSON":
-    with open(f'{pdf_json_path}') as f:
-        paper_content = json.load(f)
+    paper_content = load_paper_content(pdf_json_path, paper_format)
 elif paper_format == "LaTeX":
-    with open(f'{pdf_latex_path}') as f:
-        paper_content = f.read()
+    paper_content = load_paper_content(pdf_latex_path, paper_format)
 else:
     print(f"[ERROR] Invalid paper format. Please select either 'JSON' or 'LaTeX.")
     sys.exit(0)
@@ -51,6 +54,23 @@ todo_file_lst = task_list['Task list']
 done_file_lst = ['config.yaml']
 done_file_dict = {}
 
+if 'Logic Analysis' in task_list:
+    logic_analysis = task_list['Logic Analysis']
+elif 'logic_analysis' in task_list:
+    logic_analysis = task_list['logic_analysis']
+elif 'logic analysis' in task_list:
+    logic_analysis = task_list['logic analysis']
+else:
+    logic_analysis = []
+
+logic_analysis_dict = {}
+for desc in logic_analysis:
+    logic_analysis_dict[desc[0]] = desc[1]
+
+# class relations of "Data structures and interfaces", used to select the code context
+design = content_to_json(context_lst[1])
+design_relations = extract_design_relations(design.get('Data structures and interfaces') or "")
+
 code_msg = [
     {"role": "system", "content": f"""You are an expert researcher and software engineer with a deep understanding of experimental design and reproducibility in scientific research.
 You will receive a research paper in {paper_format} format, an overview of the plan, a Design in JSON format consisting of "Implementation approach", "File list", "Data structures and interfaces", and "Program call flow", followed by a Task in JSON format that includes "Required packages", "Required other language third-party packages", "Logic Analysis", and "Task list", along with a configuration file named "config.yaml". 
@@ -60,19 +80,9 @@ The code you write must be elegant, modular, and maintainable, adhering to Googl
 The code must strictly align with the paper's methodology, experimental setup, and evaluation metrics. 
 Write code with triple quoto."""}]
 
-def get_write_msg(todo_file_name, detailed_logic_analysis, done_file_lst): 
-    code_files = ""
-    for done_file in done_file_lst:
-        if done_file.endswith(".yaml"): continue
-        code_files += f"""
-```python
-{done_file_dict[done_file]}
-```
-
-"""
-
-    write_msg=[
-{'role': 'user', "content": f"""# Context
+# Shared by every file and built once, so each request starts with the same bytes and
+# the provider's prompt cache can reuse it. Per-file text only comes after it.
+shared_context = f"""# Context
 ## Paper
 {paper_content}
 
@@ -100,7 +110,40 @@ def get_write_msg(todo_file_name, detailed_logic_analysis, done_file_lst):
 -----
 
 ## Code Files
-{code_files}
+"""
+
+def get_write_msg(todo_file_name, detailed_logic_analysis, done_file_lst): 
+    if code_context == "relevant":
+        reference_text = f"{logic_analysis_dict.get(todo_file_name, '')}\n{detailed_logic_analysis}"
+        relevant_file_lst, _ = select_code_context(todo_file_name, done_file_lst, done_file_dict, reference_text, dependency_graph, design_relations)
+    elif code_context == "stub":
+        relevant_file_lst = []
+    else:
+        relevant_file_lst = done_file_lst
+
+    # files keep their generation order (append-only), so earlier code files also stay a common prefix
+    code_files = ""
+    for done_file in done_file_lst:
+        if done_file.endswith(".yaml"): continue
+        if done_file in relevant_file_lst:
+            code_files += f"""
+```python
+{done_file_dict[done_file]}
+```
+
+"""
+        else:
+            # files the target does not use: only their interfaces
+            code_files += f"""
+```python
+## {done_file} (interface only)
+{code_to_stub(done_file_dict[done_file])}
+```
+
+"""
+
+    write_msg=[
+{'role': 'user', "content": shared_context + f"""{code_files}
 
 -----
 
@@ -133,19 +176,17 @@ Next, you must write only the "{todo_file_name}".
     return write_msg
 
 
-def api_call(msg):
+def api_call(msg, todo_file_name):
+    request = {"model": gpt_version, "messages": msg}
     if "o3-mini" in gpt_version:
-        completion = client.chat.completions.create(
-            model=gpt_version, 
-            reasoning_effort="high",
-            messages=msg
-        )
-    else:
-        completion = client.chat.completions.create(
-            model=gpt_version, 
-            messages=msg
-        )
-    return completion
+        request["reasoning_effort"] = "high"
+    if args.stream:
+        # the artifact and the code of its first fence fill in as tokens arrive; both are rewritten from the final completion
+        save_todo_file_name = todo_file_name.replace("/", "_")
+        with ArtifactStream(f'{artifact_output_dir}/{save_todo_file_name}_coding.txt', f"{output_repo_dir}/{todo_file_name}") as stream:
+            return stream_chat_completion(client, request, stream.write)
+    completion = client.chat.completions.create(**request)
+    return json.loads(completion.model_dump_json())
     
 
 # testing for checking
@@ -165,60 +206,95 @@ for todo_file_name in todo_file_lst:
 artifact_output_dir=f'{output_dir}/coding_artifacts'
 os.makedirs(artifact_output_dir, exist_ok=True)
 
-total_accumulated_cost = load_accumulated_cost(f"{output_dir}/accumulated_cost.json")
-for todo_idx, todo_file_name in enumerate(tqdm(todo_file_lst)):
-    responses = []
-    trajectories = copy.deepcopy(code_msg)
-
-    current_stage = f"[CODING] {todo_file_name}"
-    print(current_stage)
-
-    if todo_file_name == "config.yaml":
-        continue
-
-    instruction_msg = get_write_msg(todo_file_name, detailed_logic_analysis_dict[todo_file_name], done_file_lst)
-    trajectories.extend(instruction_msg)
-
-    completion = api_call(trajectories)
-    # print(completion.choices[0].message)
-    
-    # response
-    completion_json = json.loads(completion.model_dump_json())
-    responses.append(completion_json)
-
-    # trajectories
-    message = completion.choices[0].message
-    trajectories.append({'role': message.role, 'content': message.content})
-
-    done_file_lst.append(todo_file_name)
-
-    # save
-    # save_dir_name = f"{paper_name}_repo"
-    os.makedirs(f'{output_repo_dir}', exist_ok=True)
-    save_todo_file_name = todo_file_name.replace("/", "_")
-
-
-    # print and logging
-    print_response(completion_json)
-    temp_total_accumulated_cost = print_log_cost(completion_json, gpt_version, current_stage, output_dir, total_accumulated_cost)
-    total_accumulated_cost = temp_total_accumulated_cost
-
-    # save artifacts
-    with open(f'{artifact_output_dir}/{save_todo_file_name}_coding.txt', 'w') as f:
-        f.write(completion_json['choices'][0]['message']['content'])
-
-
-    # extract code save 
-    code = extract_code_from_content(message.content)
-    if len(code) == 0:
-        code = message.content 
-
-    done_file_dict[todo_file_name] = code
-    if save_todo_file_name != todo_file_name:
-        todo_file_dir = '/'.join(todo_file_name.split("/")[:-1])
-        os.makedirs(f"{output_repo_dir}/{todo_file_dir}", exist_ok=True)
-
-    with open(f"{output_repo_dir}/{todo_file_name}", 'w') as f:
-        f.write(code)
-
-save_accumulated_cost(f"{output_dir}/accumulated_cost.json", total_accumulated_cost)
+coding_file_lst = [todo_file_name for todo_file_name in todo_file_lst if todo_file_name != "config.yaml"]
+
+# a file is generated as soon as every file it depends on is done, so independent files run concurrently
+# code of a resumed run adds the imports the logic analysis does not mention
+dependency_graph = build_dependency_graph(coding_file_lst, logic_analysis_dict, load_generated_code(output_repo_dir, coding_file_lst))
+
+# the other stages' costs; this stage's entry is rebuilt from its resumed and new calls
+other_stage_cost = load_accumulated_cost(f"{output_dir}/accumulated_cost.json", exclude_stage="coding")
+total_accumulated_cost = other_stage_cost
+pending_file_lst = list(coding_file_lst)
+completion_json_lst = []
+running_dict = {}
+with ThreadPoolExecutor(max_workers=max_concurrency) as executor, tqdm(total=len(coding_file_lst)) as pbar:
+    while pending_file_lst or running_dict:
+        # schedule every ready file (in task list order)
+        for todo_file_name in list(pending_file_lst):
+            if len(running_dict) >= max_concurrency:
+                break
+            # the first request writes the shared prefix to the provider's prompt cache; the others then reuse it
+            if len(running_dict) > 0 and len(done_file_dict) == 0:
+                break
+            if any(dep not in done_file_dict for dep in dependency_graph[todo_file_name]):
+                continue
+            pending_file_lst.remove(todo_file_name)
+
+            trajectories = copy.deepcopy(code_msg)
+            instruction_msg = get_write_msg(todo_file_name, detailed_logic_analysis_dict[todo_file_name], list(done_file_lst))
+            trajectories.extend(instruction_msg)
+
+            # keyed by model + full prompt (paper, plan, analysis, code it builds on), so a rerun skips finished files
+            checkpoint_key = get_checkpoint_key(gpt_version, trajectories)
+            future = executor.submit(run_with_checkpoint, output_dir, checkpoint_key, lambda msg=trajectories, name=todo_file_name: api_call(msg, name))
+            running_dict[future] = (todo_file_name, trajectories)
+
+        finished_futures, _ = wait(running_dict, return_when=FIRST_COMPLETED)
+        for future in sorted(finished_futures, key=lambda x: coding_file_lst.index(running_dict[x][0])):
+            todo_file_name, trajectories = running_dict.pop(future)
+            responses = []
+
+            current_stage = f"[CODING] {todo_file_name}"
+            print(current_stage)
+
+            completion_json, is_resumed = future.result()
+            
+            # response
+            responses.append(completion_json)
+
+            # trajectories
+            message = completion_json['choices'][0]['message']
+            trajectories.append({'role': message['role'], 'content': message['content']})
+
+            done_file_lst.append(todo_file_name)
+
+            # save
+            # save_dir_name = f"{paper_name}_repo"
+            os.makedirs(f'{output_repo_dir}', exist_ok=True)
+            save_todo_file_name = todo_file_name.replace("/", "_")
+
+
+            # print and logging
+            print_response(completion_json)
+            if is_resumed:
+                # paid for in an earlier run: keep it in the accumulated total without logging a new call
+                total_accumulated_cost += cal_cost(completion_json, gpt_version)['total_cost']
+                print(f"[RESUMED] {current_stage}")
+            else:
+                temp_total_accumulated_cost = print_log_cost(completion_json, gpt_version, current_stage, output_dir, total_accumulated_cost)
+                total_accumulated_cost = temp_total_accumulated_cost
+                completion_json_lst.append(completion_json)
+
+            # save artifacts
+            with open(f'{artifact_output_dir}/{save_todo_file_name}_coding.txt', 'w') as f:
+                f.write(completion_json['choices'][0]['message']['content'])
+
+
+            # extract code save 
+            code = extract_code_from_content(message['content'])
+            if len(code) == 0:
+                code = message['content'] 
+
+            done_file_dict[todo_file_name] = code
+            if save_todo_file_name != todo_file_name:
+                todo_file_dir = '/'.join(todo_file_name.split("/")[:-1])
+                os.makedirs(f"{output_repo_dir}/{todo_file_dir}", exist_ok=True)
+
+            with open(f"{output_repo_dir}/{todo_file_name}", 'w') as f:
+                f.write(code)
+
+            pbar.update(1)
+
+print_log_cache_summary(completion_json_lst, "[CODING]", output_dir)
+save_accumulated_cost(f"{output_dir}/accumulated_cost.json", "coding", total_accumulated_cost - other_stage_cost)
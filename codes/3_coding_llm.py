@@ -3,9 +3,7 @@ import os
 from tqdm import tqdm
 import sys
 import copy
-from utils import extract_planning, content_to_json, extract_code_from_content,extract_code_from_content2, print_response, print_log_cost, load_accumulated_cost, save_accumulated_cost
-from transformers import AutoTokenizer
-from vllm import LLM, SamplingParams
+from utils import get_checkpoint_key, run_batch_with_checkpoint, extract_planning, content_to_json, extract_code_from_content,extract_code_from_content2, print_response, print_log_cost, load_accumulated_cost, save_accumulated_cost, build_dependency_graph, load_generated_code, extract_design_relations, select_code_context, code_to_stub, get_dependency_levels, run_in_waves, load_paper_content, load_vllm_engine
 
 import argparse
 
@@ -24,6 +22,8 @@ parser.add_argument('--pdf_latex_path', type=str) # latex format
 
 parser.add_argument('--output_dir',type=str, default="")
 parser.add_argument('--output_repo_dir',type=str, default="")
+parser.add_argument('--code_context',type=str, default="all", choices=["all", "relevant", "stub"]) # relevant: full code only for the files the target uses, stub: interfaces only
+parser.add_argument('--wave_generation', action='store_true') # generate each dependency level in one llm.generate call
 
 args    = parser.parse_args()
 
@@ -40,14 +40,14 @@ pdf_latex_path = args.pdf_latex_path
 
 output_dir = args.output_dir
 output_repo_dir = args.output_repo_dir
+code_context = args.code_context
+wave_generation = args.wave_generation
 
     
 if paper_format == "JSON":
-    with open(f'{pdf_json_path}') as f:
-        paper_content = json.load(f)
+    paper_content = load_paper_content(pdf_json_path, paper_format)
 elif paper_format == "LaTeX":
-    with open(f'{pdf_latex_path}') as f:
-        paper_content = f.read()
+    paper_content = load_paper_content(pdf_latex_path, paper_format)
 else:
     print(f"[ERROR] Invalid paper format. Please select either 'JSON' or 'LaTeX.")
     sys.exit(0)
@@ -73,6 +73,24 @@ else:
 done_file_lst = ['config.yaml']
 done_file_dict = {}
 
+if 'Logic Analysis' in task_list:
+    logic_analysis = task_list['Logic Analysis']
+elif 'logic_analysis' in task_list:
+    logic_analysis = task_list['logic_analysis']
+elif 'logic analysis' in task_list:
+    logic_analysis = task_list['logic analysis']
+else:
+    logic_analysis = []
+
+logic_analysis_dict = {}
+for desc in logic_analysis:
+    logic_analysis_dict[desc[0]] = desc[1]
+
+# used to select the code context of each file; code of a resumed run adds the imports the logic analysis does not mention
+dependency_graph = build_dependency_graph(todo_file_lst, logic_analysis_dict, load_generated_code(output_repo_dir, todo_file_lst))
+design = content_to_json(context_lst[1])
+design_relations = extract_design_relations(design.get('Data structures and interfaces') or "")
+
 code_msg = [
     {"role": "system", "content": f"""You are an expert researcher and software engineer with a deep understanding of experimental design and reproducibility in scientific research.
 You will receive a research paper in {paper_format} format, an overview of the plan, a Design in JSON format consisting of "Implementation approach", "File list", "Data structures and interfaces", and "Program call flow", followed by a Task in JSON format that includes "Required packages", "Required other language third-party packages", "Logic Analysis", and "Task list", along with a configuration file named "config.yaml". 
@@ -83,14 +101,32 @@ The code must strictly align with the paper's methodology, experimental setup, a
 Write code with triple quoto."""}]
 
 def get_write_msg(todo_file_name, detailed_logic_analysis, done_file_lst): 
+    if code_context == "relevant":
+        reference_text = f"{logic_analysis_dict.get(todo_file_name, '')}\n{detailed_logic_analysis}"
+        relevant_file_lst, _ = select_code_context(todo_file_name, done_file_lst, done_file_dict, reference_text, dependency_graph, design_relations)
+    elif code_context == "stub":
+        relevant_file_lst = []
+    else:
+        relevant_file_lst = done_file_lst
+
     code_files = ""
     for done_file in done_file_lst:
         if done_file.endswith(".yaml"): continue
-        code_files += f"""
+        if done_file in relevant_file_lst:
+            code_files += f"""
 ```python
 {done_file_dict[done_file]}
 ```
 
+"""
+        else:
+            # files the target does not use: only their interfaces
+            code_files += f"""
+```python
+## {done_file} (interface only)
+{code_to_stub(done_file_dict[done_file])}
+```
+
 """
 
     write_msg=[
@@ -154,37 +190,27 @@ Next, you must write only the "{todo_file_name}".
 ## Code: {todo_file_name}"""}]
     return write_msg
 
-model_name = args.model_name
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-
-if "Qwen" in model_name:
-    llm = LLM(model=model_name, 
-            tensor_parallel_size=tp_size, 
-            max_model_len=max_model_len,
-            gpu_memory_utilization=0.95,
-            trust_remote_code=True, enforce_eager=True, 
-            rope_scaling={"factor": 4.0, "original_max_position_embeddings": 32768, "type": "yarn"})
-    sampling_params = SamplingParams(temperature=temperature, max_tokens=131072)
+tokenizer, llm, sampling_params = load_vllm_engine(model_name, tp_size, max_model_len, temperature)
 
-elif "deepseek" in model_name:
-    llm = LLM(model=model_name, 
-              tensor_parallel_size=tp_size, 
-              max_model_len=max_model_len,
-              gpu_memory_utilization=0.95,
-              trust_remote_code=True, enforce_eager=True)
-    sampling_params = SamplingParams(temperature=temperature, max_tokens=128000, stop_token_ids=[tokenizer.eos_token_id])
 
-
-def run_llm(msg):
+def generate_batch(msg_lst):
     # vllm
-    prompt_token_ids = [tokenizer.apply_chat_template(messages, add_generation_prompt=True) for messages in [msg]]
+    prompt_token_ids = [tokenizer.apply_chat_template(messages, add_generation_prompt=True) for messages in msg_lst]
 
     outputs = llm.generate(prompt_token_ids=prompt_token_ids, sampling_params=sampling_params)
 
+    # outputs are returned in the order of the prompts
     completion = [output.outputs[0].text for output in outputs]
     
-    return completion[0] 
+    return completion
+
+def run_llm_batch(msg_lst):
+    # keyed by model + temperature + full prompt, so a rerun only generates the unfinished files
+    checkpoint_key_lst = [get_checkpoint_key(model_name, msg, temperature=temperature) for msg in msg_lst]
+    return run_batch_with_checkpoint(output_dir, checkpoint_key_lst, msg_lst, generate_batch)
+
+def run_llm(msg):
+    return run_llm_batch([msg])[0]
     
 
 # testing for checking
@@ -205,20 +231,17 @@ for todo_file_name in todo_file_lst:
 artifact_output_dir=f'{output_dir}/coding_artifacts'
 os.makedirs(artifact_output_dir, exist_ok=True)
 
-for todo_idx, todo_file_name in enumerate(tqdm(todo_file_lst)):
-    responses = []
+def build_trajectories(todo_file_name):
     trajectories = copy.deepcopy(code_msg)
+    instruction_msg = get_write_msg(todo_file_name, detailed_logic_analysis_dict[todo_file_name], list(done_file_lst))
+    trajectories.extend(instruction_msg)
+    return trajectories
+
+def save_code(todo_file_name, trajectories, completion):
+    responses = []
 
     current_stage = f"[CODING] {todo_file_name}"
     print(current_stage)
-
-    if todo_file_name == "config.yaml":
-        continue
-
-    instruction_msg = get_write_msg(todo_file_name, detailed_logic_analysis_dict[todo_file_name], done_file_lst)
-    trajectories.extend(instruction_msg)
-
-    completion = run_llm(trajectories)
     
     # response
     completion_json = {
@@ -259,3 +282,16 @@ for todo_idx, todo_file_name in enumerate(tqdm(todo_file_lst)):
 
     with open(f"{output_repo_dir}/{todo_file_name}", 'w', encoding='utf-8') as f:
         f.write(code)
+
+coding_file_lst = [todo_file_name for todo_file_name in todo_file_lst if todo_file_name != "config.yaml"]
+
+if wave_generation:
+    # files of one level only depend on earlier levels, so each level is one batch
+    levels = get_dependency_levels({f: dependency_graph[f] for f in coding_file_lst})
+    print(f"[CODING] {len(coding_file_lst)} files in {len(levels)} waves")
+    run_in_waves(levels, build_trajectories, run_llm_batch, save_code)
+else:
+    for todo_file_name in tqdm(coding_file_lst):
+        trajectories = build_trajectories(todo_file_name)
+        completion = run_llm(trajectories)
+        save_code(todo_file_name, trajectories, completion)
@@ -0,0 +1,173 @@
+"""Run the PaperCoder pipeline over many papers.
+
+Papers are read from a manifest (by default the Paper2Code benchmark's
+`dataset_info.json`) and each one is processed by `pipeline.py` in its own
+subprocess, so a crash or an API error only fails that paper. At most
+`--max_papers` papers run at the same time. Every paper gets its own output
+directory and a summary of wall time, tokens and cost is written at the end.
+
+Arguments that batch_run.py does not know are forwarded to `pipeline.py`
+(e.g. `--backend vllm --wave_generation`). A vLLM run loads the model on the
+local GPUs, so `--backend vllm` runs one paper at a time. Token counts and
+cost are only logged by the OpenAI stages and are reported as n/a for vLLM.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import load_accumulated_cost, load_usage_summary
+
+CODES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_manifest(manifest_path, data_dir, paper_format, conferences=None):
+    """Return the papers of a manifest as dicts with `paper_name`, `paper_path` and `group`.
+
+    The manifest is either the benchmark's `{conference: [{"repo_name": ...}, ...]}` file,
+    whose papers are looked up as `{data_dir}/{conference}/{repo_name}_cleaned.json`, or a
+    list of `{"paper_name": ..., "paper_path": ...}` entries.
+    """
+    data_dir = os.path.abspath(data_dir)  # pipeline.py runs with cwd=CODES_DIR
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    ext = "json" if paper_format == "JSON" else "tex"
+    paper_lst = []
+    if isinstance(manifest, dict):
+        for conference, entries in manifest.items():
+            if conferences and conference not in conferences:
+                continue
+            for entry in entries:
+                paper_name = entry["repo_name"]
+                paper_lst.append({
+                    "paper_name": paper_name,
+                    "paper_path": os.path.join(data_dir, conference, f"{paper_name}_cleaned.{ext}"),
+                    "group": conference,
+                })
+    else:
+        for entry in manifest:
+            paper_lst.append({
+                "paper_name": entry["paper_name"],
+                "paper_path": os.path.abspath(entry["paper_path"]),
+                "group": entry.get("group", ""),
+            })
+    return paper_lst
+
+
+def get_backend(pipeline_args):
+    """The `--backend` forwarded to pipeline.py (its default is openai)."""
+    for idx, arg in enumerate(pipeline_args):
+        if arg == "--backend" and idx + 1 < len(pipeline_args):
+            return pipeline_args[idx + 1]
+        if arg.startswith("--backend="):
+            return arg.split("=", 1)[1]
+    return "openai"
+
+
+def run_paper(paper, output_root, paper_format, pipeline_args):
+    """Run the pipeline for one paper in a subprocess and return its summary."""
+    paper_name = paper["paper_name"]
+    output_dir = os.path.join(output_root, paper["group"], paper_name)
+    output_repo_dir = os.path.join(output_root, paper["group"], f"{paper_name}_repo")
+    os.makedirs(output_dir, exist_ok=True)
+
+    path_arg = "--pdf_json_path" if paper_format == "JSON" else "--pdf_latex_path"
+    cmd = [
+        sys.executable, os.path.join(CODES_DIR, "pipeline.py"),
+        "--paper_name", paper_name,
+        "--paper_format", paper_format,
+        path_arg, paper["paper_path"],
+        "--output_dir", output_dir,
+        "--output_repo_dir", output_repo_dir,
+    ] + pipeline_args
+
+    summary = {"paper_name": paper_name, "group": paper["group"], "output_dir": output_dir,
+               "backend": get_backend(pipeline_args)}
+    start = time.time()
+    if not os.path.exists(paper["paper_path"]):
+        summary.update({"status": "missing", "error": f"{paper['paper_path']} does not exist"})
+    else:
+        with open(os.path.join(output_dir, "pipeline.log"), "w", encoding="utf-8") as log:
+            returncode = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=CODES_DIR).returncode
+        summary["status"] = "ok" if returncode == 0 else "failed"
+        if returncode != 0:
+            summary["error"] = f"exit code {returncode}, see {output_dir}/pipeline.log"
+    summary["wall_time_sec"] = time.time() - start
+
+    if summary["backend"] == "openai":
+        usage = load_usage_summary(output_dir)
+        summary.update({k: usage[k] for k in ["calls", "input_tokens", "cached_tokens", "output_tokens"]})
+        summary["total_cost"] = load_accumulated_cost(f"{output_dir}/accumulated_cost.json")
+    else:
+        # the vLLM stages don't write usage_log.jsonl, so there is nothing to report
+        summary.update({k: None for k in ["calls", "input_tokens", "cached_tokens", "output_tokens", "total_cost"]})
+
+    cost = "n/a" if summary["total_cost"] is None else f"${summary['total_cost']:.4f}"
+    print(f"[{summary['status'].upper()}] {paper['group']}/{paper_name} ({summary['wall_time_sec']:.1f}s, {cost})")
+    return summary
+
+
+def print_summary(summary_lst, wall_time_sec):
+    print("============================================")
+    print("🌟 Batch Summary 🌟")
+    print(f"{'paper':<45} {'status':<8} {'time(s)':>9} {'in tok':>10} {'out tok':>9} {'cost($)':>9}")
+    for summary in summary_lst:
+        name = f"{summary['group']}/{summary['paper_name']}".strip("/")
+        if summary["total_cost"] is None:
+            tokens = f"{'n/a':>10} {'n/a':>9} {'n/a':>9}"
+        else:
+            tokens = f"{summary['input_tokens']:>10} {summary['output_tokens']:>9} {summary['total_cost']:>9.4f}"
+        print(f"{name:<45} {summary['status']:<8} {summary['wall_time_sec']:>9.1f} {tokens}")
+    n_ok = sum(1 for summary in summary_lst if summary["status"] == "ok")
+    print(f"✅ Succeeded: {n_ok}/{len(summary_lst)}")
+    if any(summary["total_cost"] is None for summary in summary_lst):
+        print("💵 Tokens and cost are not tracked for the vllm backend")
+    print(f"💵 Total cost: ${sum(summary['total_cost'] or 0.0 for summary in summary_lst):.4f}")
+    print(f"⏱️ Wall time: {wall_time_sec:.1f}s")
+    print("============================================")
+
+
+def main(args, pipeline_args):
+    args.output_root = os.path.abspath(args.output_root)
+    if get_backend(pipeline_args) == "vllm" and args.max_papers != 1:
+        # every vLLM stage loads the model on all visible GPUs; parallel papers would contend for them
+        print(f"[BATCH] --backend vllm runs one paper at a time (ignoring --max_papers {args.max_papers})")
+        args.max_papers = 1
+    paper_lst = load_manifest(args.manifest, args.data_dir, args.paper_format, args.conferences)
+    if args.limit:
+        paper_lst = paper_lst[:args.limit]
+    print(f"[BATCH] {len(paper_lst)} papers, up to {args.max_papers} at a time")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.max_papers)) as executor:
+        summary_lst = list(executor.map(
+            lambda paper: run_paper(paper, args.output_root, args.paper_format, pipeline_args), paper_lst
+        ))
+    wall_time_sec = time.time() - start
+
+    print_summary(summary_lst, wall_time_sec)
+
+    os.makedirs(args.output_root, exist_ok=True)
+    summary_path = os.path.join(args.output_root, "batch_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump({"wall_time_sec": wall_time_sec, "papers": summary_lst}, f, indent=2)
+    print(f"[SAVED] {summary_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", type=str, default="../data/paper2code/dataset_info.json")
+    parser.add_argument("--data_dir", type=str, default="../data/paper2code")
+    parser.add_argument("--paper_format", type=str, default="JSON", choices=["JSON", "LaTeX"])
+    parser.add_argument("--output_root", type=str, default="../outputs/paper2code")
+    parser.add_argument("--max_papers", type=int, default=4) # papers processed at the same time
+    parser.add_argument("--conferences", type=str, nargs="*") # e.g. iclr2024 icml2024
+    parser.add_argument("--limit", type=int, default=0) # only run the first N papers
+
+    args, pipeline_args = parser.parse_known_args()
+    main(args, pipeline_args)
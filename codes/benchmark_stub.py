@@ -0,0 +1,59 @@
+import argparse
+import time
+from utils import read_python_files, code_to_stub
+
+def get_token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=())), "o200k_base"
+    except ImportError:
+        # same estimate the llm_router uses
+        return lambda text: len(text) // 4, "len/4 estimate (tiktoken not installed)"
+
+def main(args):
+    code_dict = read_python_files(args.repo_dir)
+    if len(code_dict) == 0:
+        print(f"[ERROR] No Python files found in {args.repo_dir}. Run PaperCoder first (e.g. scripts/run.sh).")
+        return
+
+    count_tokens, tokenizer_name = get_token_counter()
+
+    start = time.perf_counter()
+    stub_dict = {file_name: code_to_stub(code) for file_name, code in code_dict.items()}
+    cold_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for code in code_dict.values():
+        code_to_stub(code)
+    cached_time = time.perf_counter() - start
+
+    total_code_tokens = 0
+    total_stub_tokens = 0
+    print(f"{'file':<40} {'code':>8} {'stub':>8} {'saved':>7}")
+    for file_name in sorted(code_dict):
+        code_tokens = count_tokens(code_dict[file_name])
+        stub_tokens = count_tokens(stub_dict[file_name])
+        total_code_tokens += code_tokens
+        total_stub_tokens += stub_tokens
+        saved = 1 - stub_tokens / code_tokens if code_tokens else 0.0
+        print(f"{file_name:<40} {code_tokens:>8} {stub_tokens:>8} {saved:>6.1%}")
+
+    # with --code_context all every file is resent to each later file; stubs shrink that context
+    n_files = len(code_dict)
+    saved = 1 - total_stub_tokens / total_code_tokens if total_code_tokens else 0.0
+    print("============================================")
+    print(f"📁 Repository: {args.repo_dir} ({n_files} files)")
+    print(f"🔢 Tokenizer: {tokenizer_name}")
+    print(f"📄 Full code tokens: {total_code_tokens}")
+    print(f"🧩 Stub tokens: {total_stub_tokens}")
+    print(f"📉 Reduction: {saved:.1%}")
+    print(f"⏱️ Stub time: {cold_time * 1000:.2f} ms (cached: {cached_time * 1000:.2f} ms)")
+    print("============================================")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo_dir", type=str, default="../outputs/Transformer_repo")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,44 @@
+import argparse
+import time
+
+import fitz  # PyMuPDF
+from pdf_to_json_simple import camelot, extract_all_tables, extract_tables, is_table_candidate
+
+def main(args):
+    if camelot is None:
+        print("[ERROR] camelot is not installed (pip install camelot-py).")
+        return
+
+    doc = fitz.open(args.pdf_path)
+    page_numbers = [page.number + 1 for page in doc]
+
+    # before: one camelot call, and one parse of the PDF, per page
+    start = time.perf_counter()
+    per_page_tables = {page_num: extract_tables(args.pdf_path, page_num) for page_num in page_numbers}
+    per_page_time = time.perf_counter() - start
+
+    # after: pre-screen the pages with PyMuPDF, then one camelot call for the candidates
+    start = time.perf_counter()
+    candidate_lst = [page.number + 1 for page in doc if is_table_candidate(page)]
+    screen_time = time.perf_counter() - start
+    table_dict = extract_all_tables(args.pdf_path, candidate_lst)
+    single_pass_time = time.perf_counter() - start
+
+    n_per_page = sum(len(tables) for tables in per_page_tables.values())
+    n_single_pass = sum(len(tables) for tables in table_dict.values())
+    saved = 1 - single_pass_time / per_page_time if per_page_time else 0.0
+    print("============================================")
+    print(f"📄 PDF: {args.pdf_path} ({len(page_numbers)} pages)")
+    print(f"🔍 Table candidates: {candidate_lst} (screened in {screen_time * 1000:.1f} ms)")
+    print(f"📊 Tables found: per-page {n_per_page}, single pass {n_single_pass}")
+    print(f"⏱️ Per-page camelot: {per_page_time:.2f}s")
+    print(f"⏱️ Pre-screen + single pass: {single_pass_time:.2f}s")
+    print(f"📉 Time saved: {per_page_time - single_pass_time:.2f}s ({saved:.1%})")
+    print("============================================")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf_path", type=str, default="../examples/Transformer.pdf")
+    args = parser.parse_args()
+    main(args)
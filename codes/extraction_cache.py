@@ -0,0 +1,154 @@
+"""Content-addressed cache of PDF extraction results, shared by the PDF converters.
+
+`pdf_to_json_simple.py`, `pdf_to_json_hybrid.py` and `tasks/pdf_to_json.py` store what they
+extract per page (and per document, e.g. the GROBID TEI) under
+`{cache_dir}/{extractor}/{key[:2]}/{key}.pkl`. The key is a SHA-256 of the PDF's content
+hash, the extractor name and version, its options and the page number, so renaming or
+moving a PDF still hits, and a re-run only extracts the pages that are not cached yet.
+The cache is kept under `max_size_mb` by evicting the least recently used entries.
+
+Inspect or prune it from the command line:
+
+    python extraction_cache.py stats
+    python extraction_cache.py prune --older_than_days 30 --max_size_mb 512
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.environ.get("PDF_EXTRACTION_CACHE", "~/.cache/paper2code/extraction")
+DEFAULT_MAX_SIZE_MB = 2048
+
+
+def file_sha256(path):
+    """SHA-256 of a file's content, read in 1 MB blocks."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._sizes = None  # path -> size, scanned from disk on first write
+        self._lock = threading.Lock()
+
+    def key(self, pdf_hash, extractor, version, options=None, page=None):
+        """Key of one page (`page`, 1-based) or, with `page=None`, of a whole-document result."""
+        payload = {"pdf": pdf_hash, "extractor": extractor, "version": version, "options": options or {}, "page": page}
+        return f"{extractor}/" + hashlib.sha256(json.dumps(payload, sort_keys=True, default=repr).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        extractor, digest = key.split("/")
+        return os.path.join(self.cache_dir, extractor, digest[:2], f"{digest}.pkl")
+
+    def get(self, key):
+        """Return the cached value of `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return None
+        os.utime(path)  # mtime marks the last use for LRU eviction
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename, so concurrent readers (e.g. --workers processes) never see a truncated entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            sizes = self._scan() if self._sizes is None else self._sizes
+            sizes[path] = os.path.getsize(path)
+            if sum(sizes.values()) > self.max_bytes:
+                self._evict(sizes, 0.9 * self.max_bytes)
+
+    def _scan(self):
+        self._sizes = {}
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                if file_name.endswith(".pkl"):
+                    path = os.path.join(root, file_name)
+                    self._sizes[path] = os.path.getsize(path)
+        return self._sizes
+
+    def _evict(self, sizes, target_bytes, older_than=None):
+        # drop least recently used entries until the cache is below `target_bytes`,
+        # and every entry last used before `older_than` (a timestamp)
+        removed = 0
+        total = sum(sizes.values())
+        mtimes = {path: os.path.getmtime(path) if os.path.exists(path) else 0 for path in sizes}
+        for path in sorted(sizes, key=mtimes.get):
+            if total <= target_bytes and (older_than is None or mtimes[path] >= older_than):
+                break
+            total -= sizes.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            removed += 1
+        return removed
+
+    def prune(self, max_size_mb=None, older_than_days=None):
+        """Evict entries unused for `older_than_days`, then LRU entries above `max_size_mb`; return how many."""
+        with self._lock:
+            sizes = self._scan()
+            older_than = time.time() - older_than_days * 86400 if older_than_days is not None else None
+            target_bytes = max_size_mb * 1024 * 1024 if max_size_mb is not None else float("inf")
+            return self._evict(sizes, target_bytes, older_than)
+
+    def stats(self):
+        with self._lock:
+            sizes = self._scan()
+        extractor_dict = {}
+        for path, size in sizes.items():
+            extractor = os.path.relpath(path, self.cache_dir).split(os.sep)[0]
+            entry = extractor_dict.setdefault(extractor, {"entries": 0, "bytes": 0})
+            entry["entries"] += 1
+            entry["bytes"] += size
+        return {"hits": self.hits, "misses": self.misses, "entries": len(sizes),
+                "bytes": sum(sizes.values()), "extractors": extractor_dict}
+
+
+def print_stats(stats, cache_dir):
+    print("============================================")
+    print(f"🗄️ Extraction cache: {cache_dir}")
+    print(f"{'extractor':<30} {'entries':>8} {'MB':>10}")
+    for extractor, entry in sorted(stats["extractors"].items()):
+        print(f"{extractor:<30} {entry['entries']:>8} {entry['bytes'] / 1024 / 1024:>10.2f}")
+    print(f"{'total':<30} {stats['entries']:>8} {stats['bytes'] / 1024 / 1024:>10.2f}")
+    print("============================================")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or prune the PDF extraction cache")
+    parser.add_argument("command", choices=["stats", "prune"])
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max_size_mb", type=float) # prune: evict least recently used entries above this size
+    parser.add_argument("--older_than_days", type=float) # prune: evict entries not used for this many days
+    args = parser.parse_args()
+
+    cache = ExtractionCache(args.cache_dir)
+    if args.command == "prune":
+        if args.max_size_mb is None and args.older_than_days is None:
+            parser.error("prune needs --max_size_mb and/or --older_than_days")
+        print(f"[PRUNED] {cache.prune(args.max_size_mb, args.older_than_days)} entries")
+    print_stats(cache.stats(), cache.cache_dir)
@@ -3,7 +3,9 @@
 This script demonstrates a simple pipeline that combines modern
 PDF text extraction libraries with metadata extracted from a running
 GROBID server. The resulting JSON contains page level text and the
-TEI XML from GROBID.
+TEI XML from GROBID. Both are kept in the shared extraction cache,
+keyed by the PDF's content hash, so re-running on the same PDF skips
+GROBID and every page that was already extracted.
 """
 
 import argparse
@@ -14,13 +16,27 @@ from pathlib import Path
 
 import pdfplumber  # type: ignore
 
+try:
+    from extraction_cache import DEFAULT_CACHE_DIR, ExtractionCache, file_sha256
+except ImportError:
+    from codes.extraction_cache import DEFAULT_CACHE_DIR, ExtractionCache, file_sha256
 
-def extract_pages(pdf_path: str):
-    """Extract text from each page using pdfplumber."""
+EXTRACTOR = "pdf_to_json_hybrid"
+EXTRACTOR_VERSION = "1"  # bump when the extracted content changes
+
+
+def extract_pages(pdf_path: str, cache=None, pdf_hash=None):
+    """Extract text from each page using pdfplumber; pages cached for `pdf_hash` are reused."""
     pages = []
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            pages.append(page.extract_text() or "")
+        for page_num, page in enumerate(pdf.pages, start=1):
+            key = cache.key(pdf_hash, EXTRACTOR, EXTRACTOR_VERSION, page=page_num) if cache is not None else None
+            text = cache.get(key) if cache is not None else None
+            if text is None:
+                text = page.extract_text() or ""
+                if cache is not None:
+                    cache.put(key, text)
+            pages.append(text)
     return pages
 
 
@@ -41,13 +57,23 @@ def call_grobid(pdf_path: str, out_dir: str, grobid_url: str):
     return tei_file
 
 
-def build_json(pdf_path: str, out_json: str, grobid_url: str):
-    os.makedirs("temp_grobid", exist_ok=True)
-    tei_file = call_grobid(pdf_path, "temp_grobid", grobid_url)
-    pages = extract_pages(pdf_path)
+def build_json(pdf_path: str, out_json: str, grobid_url: str, cache_dir=None):
+    cache = ExtractionCache(cache_dir) if cache_dir else None
+    pdf_hash = file_sha256(pdf_path) if cache is not None else None
+    # the TEI is a whole-document result (no page number)
+    tei_key = cache.key(pdf_hash, EXTRACTOR, EXTRACTOR_VERSION, {"tei": "processFulltext"}) if cache is not None else None
+    tei_xml = cache.get(tei_key) if cache is not None else None
+    if tei_xml is None:
+        os.makedirs("temp_grobid", exist_ok=True)
+        tei_file = call_grobid(pdf_path, "temp_grobid", grobid_url)
+        if tei_file.exists():
+            tei_xml = tei_file.read_text()
+            if cache is not None:
+                cache.put(tei_key, tei_xml)
+    pages = extract_pages(pdf_path, cache, pdf_hash)
     data = {"pages": pages}
-    if tei_file.exists():
-        data["tei_xml"] = tei_file.read_text()
+    if tei_xml is not None:
+        data["tei_xml"] = tei_xml
     with open(out_json, "w") as f:
         json.dump(data, f)
     print(f"[SAVED] {out_json}")
@@ -58,6 +84,8 @@ if __name__ == "__main__":
     parser.add_argument("--pdf_path", required=True)
     parser.add_argument("--output_json", required=True)
     parser.add_argument("--grobid_url", default="http://localhost:8070")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR) # shared extraction cache (see extraction_cache.py)
+    parser.add_argument("--no_cache", action="store_true")
     args = parser.parse_args()
 
-    build_json(args.pdf_path, args.output_json, args.grobid_url)
+    build_json(args.pdf_path, args.output_json, args.grobid_url, None if args.no_cache else args.cache_dir)
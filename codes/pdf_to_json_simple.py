@@ -4,23 +4,49 @@ This script provides a lightweight pipeline for extracting
 text and tables from a PDF without requiring GROBID or
 other complex services. It relies on PyMuPDF for direct
 text extraction and falls back to Tesseract OCR when
-no text is detected on a page. Detected tables are
-extracted with camelot if available.
+no text is detected on a page. Text-less pages are found
+first, rendered once each with PyMuPDF and recognized by
+a pool of Tesseract workers. Pages whose vector
+drawings contain ruling lines are table candidates, and
+camelot (if available) reads all candidates in one call.
+With `--workers N` page ranges are extracted in N processes,
+each with its own document handle. `--output_format jsonl`
+writes one JSON object per page as soon as the page is
+extracted. Pages are cached by the PDF's content hash in the
+shared extraction cache, so a re-run only extracts the pages
+that are not cached yet.
 """
 
 import argparse
 import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice, repeat
 from pathlib import Path
 
 import fitz  # PyMuPDF
 from pdf2image import convert_from_path
 import pytesseract
 
+# flat imports when run from codes/, package imports when imported as `codes.pdf_to_json_simple`
+try:
+    from extraction_cache import DEFAULT_CACHE_DIR, ExtractionCache, file_sha256
+    from utils import write_pages_jsonl
+except ImportError:
+    from codes.extraction_cache import DEFAULT_CACHE_DIR, ExtractionCache, file_sha256
+    from codes.utils import write_pages_jsonl
+
 try:
     import camelot  # type: ignore
 except Exception:  # pragma: no cover - optional dependency
     camelot = None
 
+EXTRACTOR = "pdf_to_json_simple"
+EXTRACTOR_VERSION = "1"  # bump when the extracted page content changes
+
+_cache_dict = {}
+
 
 def extract_page_text(page):
     """Return text from a PyMuPDF page, using OCR if needed."""
@@ -48,31 +74,184 @@ def extract_tables(pdf_path: str, page_number: int):
         return []
 
 
-def extract_pages(pdf_path: str):
-    """Process all pages in the PDF and collect text and tables."""
-    doc = fitz.open(pdf_path)
-    pages = []
-    for page in doc:
+def is_table_candidate(page, min_rules: int = 2):
+    """Cheap pre-screen: camelot's lattice mode needs horizontal and vertical ruling lines."""
+    n_horizontal = n_vertical = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                width, height = abs(item[2].x - item[1].x), abs(item[2].y - item[1].y)
+            elif item[0] == "re":
+                width, height = item[1].width, item[1].height
+            else:
+                continue
+            # a rule is a line, or a thin rectangle, along one axis
+            if height < 2 and width > 5:
+                n_horizontal += 1
+            elif width < 2 and height > 5:
+                n_vertical += 1
+    return n_horizontal >= min_rules and n_vertical >= min_rules
+
+
+def extract_all_tables(pdf_path: str, page_numbers):
+    """Return {page number: tables} for `page_numbers`, parsing the PDF with camelot once."""
+    if camelot is None or not page_numbers:
+        return {}
+    try:
+        tables = camelot.read_pdf(pdf_path, pages=",".join(str(page_num) for page_num in page_numbers))
+    except Exception:
+        # one bad page should not cost the tables of the others
+        return {page_num: extract_tables(pdf_path, page_num) for page_num in page_numbers}
+    table_dict = {}
+    for t in tables:
+        table_dict.setdefault(int(t.page), []).append(t.df.to_dict())
+    return table_dict
+
+
+def render_page(page, dpi: int = 300):
+    """Rasterize a PyMuPDF page in-process, without re-opening the PDF."""
+    from PIL import Image  # installed with pdf2image and pytesseract
+
+    pix = page.get_pixmap(dpi=dpi)
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def ocr_pages(pages, ocr_workers: int):
+    """Return {page number: OCR text} for `pages`, rendering each page once.
+
+    Pages are rendered one after another (a document is not thread safe), and each image
+    goes to a Tesseract worker right away; at most 2 * `ocr_workers` images are held.
+    """
+    texts = {}
+    with ThreadPoolExecutor(max_workers=ocr_workers) as executor:
+        pending = deque()
+        for page in pages:
+            if len(pending) >= 2 * ocr_workers:
+                page_num, future = pending.popleft()
+                texts[page_num] = future.result()
+            pending.append((page.number + 1, executor.submit(pytesseract.image_to_string, render_page(page))))
+        for page_num, future in pending:
+            texts[page_num] = future.result()
+    return texts
+
+
+def extract_doc_pages(pdf_path: str, pages, ocr_workers: int, cache=None, pdf_hash=None):
+    """Collect text and tables of `pages`; text-less pages and table candidates are each handled in one batch.
+
+    With a `cache`, pages cached for `pdf_hash` are reused and only the others are extracted.
+    """
+    page_lst = list(pages)
+    page_num_lst = [page.number + 1 for page in page_lst]
+    cached = {}
+    if cache is not None:
+        options = {"ocr_dpi": 300, "camelot": camelot is not None}
+        key_dict = {page_num: cache.key(pdf_hash, EXTRACTOR, EXTRACTOR_VERSION, options, page_num) for page_num in page_num_lst}
+        for page_num, key in key_dict.items():
+            page_data = cache.get(key)
+            if page_data is not None:
+                cached[page_num] = page_data
+        page_lst = [page for page in page_lst if page.number + 1 not in cached]
+
+    text_lst = [page.get_text() for page in page_lst]
+    ocr_texts = ocr_pages([page for page, text in zip(page_lst, text_lst) if not text.strip()], ocr_workers)
+    table_dict = extract_all_tables(pdf_path, [page.number + 1 for page in page_lst if is_table_candidate(page)])
+    for page, text in zip(page_lst, text_lst):
         page_num = page.number + 1
-        text = extract_page_text(page)
-        tables = extract_tables(pdf_path, page_num)
-        pages.append({"page_number": page_num, "text": text, "tables": tables})
-    return pages
+        text = ocr_texts.get(page_num, text)
+        tables = table_dict.get(page_num, [])
+        cached[page_num] = {"page_number": page_num, "text": text, "tables": tables}
+        if cache is not None:
+            cache.put(key_dict[page_num], cached[page_num])
+    return [cached[page_num] for page_num in page_num_lst]
+
+
+def get_cache(cache_dir):
+    """The ExtractionCache of this process for `cache_dir`, so its size is scanned once per process, not per range."""
+    if not cache_dir:
+        return None
+    if cache_dir not in _cache_dict:
+        _cache_dict[cache_dir] = ExtractionCache(cache_dir)
+    return _cache_dict[cache_dir]
+
+
+def extract_page_range(pdf_path: str, start: int, stop: int, ocr_workers: int = 1, cache_dir=None, pdf_hash=None):
+    """Process pages [start, stop) (0-based) with a document handle (and cache) of this process."""
+    doc = fitz.open(pdf_path)
+    try:
+        return extract_doc_pages(pdf_path, doc.pages(start, stop), ocr_workers, get_cache(cache_dir), pdf_hash)
+    finally:
+        doc.close()
+
 
+def iter_pages(pdf_path: str, workers: int = 1, ocr_workers: int = 0, batch_size: int = 32, cache_dir=None):
+    """Yield the text and tables of every page in page order, as soon as they are extracted.
 
-def build_json(pdf_path: str, out_json: str):
-    pages = extract_pages(pdf_path)
+    Pages are extracted `batch_size` at a time, so OCR and camelot still run once per batch
+    while memory stays bounded. With `workers > 1` the pages are split into ranges that a
+    process pool extracts in parallel. With `cache_dir`, pages come from the extraction
+    cache when this PDF content was extracted before.
+    """
+    ocr_workers = ocr_workers or max(1, (os.cpu_count() or 1) // max(1, workers))
+    pdf_hash = file_sha256(pdf_path) if cache_dir else None
+    doc = fitz.open(pdf_path)
+    if workers <= 1:
+        cache = get_cache(cache_dir)
+        page_iter = iter(doc)
+        try:
+            while True:
+                batch = list(islice(page_iter, batch_size))
+                if not batch:
+                    return
+                yield from extract_doc_pages(pdf_path, batch, ocr_workers, cache, pdf_hash)
+        finally:
+            doc.close()
+
+    n_pages = doc.page_count
+    doc.close()
+    # several small ranges per worker, so a few slow (OCR) pages don't leave the others idle
+    range_size = min(batch_size, max(1, -(-n_pages // (workers * 4))))
+    starts = list(range(0, n_pages, range_size))
+    stops = [min(start + range_size, n_pages) for start in starts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        page_ranges = executor.map(extract_page_range, repeat(pdf_path), starts, stops,
+                                   repeat(ocr_workers), repeat(cache_dir), repeat(pdf_hash))
+        for page_range in page_ranges:
+            yield from page_range
+
+
+def extract_pages(pdf_path: str, workers: int = 1, ocr_workers: int = 0, cache_dir=None):
+    """Process all pages in the PDF and collect text and tables."""
+    return list(iter_pages(pdf_path, workers, ocr_workers, cache_dir=cache_dir))
+
+
+def build_json(pdf_path: str, out_json: str, workers: int = 1, ocr_workers: int = 0, cache_dir=None):
+    pages = extract_pages(pdf_path, workers, ocr_workers, cache_dir)
     data = {"pages": pages}
     Path(out_json).write_text(json.dumps(data, indent=2))
     print(f"[SAVED] {out_json}")
 
 
+def build_jsonl(pdf_path: str, out_jsonl: str, workers: int = 1, ocr_workers: int = 0, cache_dir=None):
+    """Write one page per line as the pages are extracted; read it back with `utils.read_pages_jsonl`."""
+    n_pages = write_pages_jsonl(iter_pages(pdf_path, workers, ocr_workers, cache_dir=cache_dir), out_jsonl)
+    print(f"[SAVED] {out_jsonl} ({n_pages} pages)")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Simple PDF to JSON converter without GROBID"
     )
     parser.add_argument("--pdf_path", required=True)
     parser.add_argument("--output_json", required=True)
+    parser.add_argument("--workers", type=int, default=1) # processes extracting page ranges in parallel
+    parser.add_argument("--ocr_workers", type=int, default=0) # Tesseract workers per process, 0: CPUs / workers
+    parser.add_argument("--output_format", default="json", choices=["json", "jsonl"]) # jsonl: one page per line, written as extracted
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR) # shared extraction cache (see extraction_cache.py)
+    parser.add_argument("--no_cache", action="store_true")
     args = parser.parse_args()
 
-    build_json(args.pdf_path, args.output_json)
+    cache_dir = None if args.no_cache else args.cache_dir
+    if args.output_format == "jsonl":
+        build_jsonl(args.pdf_path, args.output_json, args.workers, args.ocr_workers, cache_dir)
+    else:
+        build_json(args.pdf_path, args.output_json, args.workers, args.ocr_workers, cache_dir)
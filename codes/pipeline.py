@@ -0,0 +1,113 @@
+"""Run the whole PaperCoder pipeline in a single process.
+
+The stage scripts (planning -> config extraction -> analysis -> coding) are executed
+one after another in this process instead of as separate `python` invocations.
+The paper, the OpenAI client and the vLLM engine/tokenizer are created once by
+`utils` and reused by every stage, so the model is only loaded once per paper.
+All artifacts are written to the same places as with `scripts/run*.sh`.
+"""
+
+import argparse
+import os
+import runpy
+import shutil
+import sys
+import time
+
+CODES_DIR = os.path.dirname(os.path.abspath(__file__))
+if CODES_DIR not in sys.path:
+    sys.path.insert(0, CODES_DIR)
+
+
+def run_stage(script_name, stage_args):
+    """Execute a stage script in this process with the given command line arguments."""
+    script_path = os.path.join(CODES_DIR, script_name)
+    argv = sys.argv
+    sys.argv = [script_path] + [str(arg) for arg in stage_args]
+    start = time.time()
+    try:
+        runpy.run_path(script_path, run_name="__main__")
+    finally:
+        sys.argv = argv
+    print(f"[PIPELINE] {script_name} finished in {time.time() - start:.1f}s")
+
+
+def get_paper_args(args):
+    paper_args = ["--paper_name", args.paper_name, "--paper_format", args.paper_format]
+    if args.pdf_json_path:
+        paper_args += ["--pdf_json_path", args.pdf_json_path]
+    if args.pdf_latex_path:
+        paper_args += ["--pdf_latex_path", args.pdf_latex_path]
+    return paper_args
+
+
+def get_model_args(args):
+    if args.backend == "openai":
+        # the vLLM stages generate offline batches, which don't stream
+        return ["--gpt_version", args.gpt_version] + (["--stream"] if args.stream else [])
+    return ["--model_name", args.model_name, "--tp_size", args.tp_size,
+            "--temperature", args.temperature, "--max_model_len", args.max_model_len]
+
+
+def run_pipeline(args):
+    suffix = "" if args.backend == "openai" else "_llm"
+    paper_args = get_paper_args(args)
+    model_args = get_model_args(args)
+    output_args = ["--output_dir", args.output_dir]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    os.makedirs(args.output_repo_dir, exist_ok=True)
+
+    print(f"[PIPELINE] {args.paper_name} ({args.backend})")
+
+    run_stage(f"1_planning{suffix}.py", paper_args + model_args + output_args)
+
+    run_stage("1.1_extract_config.py", ["--paper_name", args.paper_name] + output_args)
+    shutil.copy(f"{args.output_dir}/planning_config.yaml", f"{args.output_repo_dir}/config.yaml")
+
+    analysis_args = []
+    if args.backend == "openai":
+        analysis_args += ["--max_concurrency", args.max_concurrency]
+    elif args.batch_generation:
+        analysis_args += ["--batch_generation"]
+    run_stage(f"2_analyzing{suffix}.py", paper_args + model_args + output_args + analysis_args)
+
+    coding_args = ["--output_repo_dir", args.output_repo_dir, "--code_context", args.code_context]
+    if args.backend == "openai":
+        coding_args += ["--max_concurrency", args.max_concurrency]
+    elif args.wave_generation:
+        coding_args += ["--wave_generation"]
+    run_stage(f"3_coding{suffix}.py", paper_args + model_args + output_args + coding_args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--paper_name',type=str)
+    parser.add_argument('--backend',type=str, default="openai", choices=["openai", "vllm"])
+
+    # openai
+    parser.add_argument('--gpt_version',type=str, default="o3-mini")
+
+    # vllm
+    parser.add_argument('--model_name',type=str, default="deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct")
+    parser.add_argument('--tp_size',type=int, default=2)
+    parser.add_argument('--temperature',type=float, default=1.0)
+    parser.add_argument('--max_model_len',type=int, default=128000)
+
+    parser.add_argument('--paper_format',type=str, default="JSON", choices=["JSON", "LaTeX"])
+    parser.add_argument('--pdf_json_path', type=str) # json format
+    parser.add_argument('--pdf_latex_path', type=str) # latex format
+
+    parser.add_argument('--output_dir',type=str, default="")
+    parser.add_argument('--output_repo_dir',type=str, default="")
+
+    # stage options
+    parser.add_argument('--max_concurrency',type=int, default=1)
+    parser.add_argument('--code_context',type=str, default="all", choices=["all", "relevant", "stub"])
+    parser.add_argument('--batch_generation', action='store_true')
+    parser.add_argument('--wave_generation', action='store_true')
+    parser.add_argument('--stream', action='store_true') # openai backend: write responses to the artifacts as they arrive
+
+    args = parser.parse_args()
+    run_pipeline(args)
@@ -1,8 +1,148 @@
+import ast
+import hashlib
 import json
 import re
 import os
 from datetime import datetime
 
+# process-wide objects, shared by the stages when they run in one process (see pipeline.py)
+_openai_client = None
+_vllm_engine_dict = {}
+_paper_content_dict = {}
+
+def get_openai_client():
+    """Return the OpenAI client of this process, creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        from openai import OpenAI
+        _openai_client = OpenAI(api_key = os.environ["OPENAI_API_KEY"])
+    return _openai_client
+
+
+def load_vllm_engine(model_name, tp_size, max_model_len, temperature):
+    """Return (tokenizer, llm, sampling_params); the model is loaded once per process."""
+    from transformers import AutoTokenizer
+    from vllm import LLM, SamplingParams
+
+    engine_key = (model_name, tp_size, max_model_len)
+    if engine_key not in _vllm_engine_dict:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        if "Qwen" in model_name:
+            llm = LLM(model=model_name, 
+                    tensor_parallel_size=tp_size, 
+                    max_model_len=max_model_len,
+                    gpu_memory_utilization=0.95,
+                    trust_remote_code=True, enforce_eager=True, 
+                    rope_scaling={"factor": 4.0, "original_max_position_embeddings": 32768, "type": "yarn"})
+        elif "deepseek" in model_name:
+            llm = LLM(model=model_name, 
+                      tensor_parallel_size=tp_size, 
+                      max_model_len=max_model_len,
+                      gpu_memory_utilization=0.95,
+                      trust_remote_code=True, enforce_eager=True)
+        else:
+            raise ValueError(f"Unsupported model for vLLM: {model_name}")
+
+        _vllm_engine_dict[engine_key] = (tokenizer, llm)
+
+    tokenizer, llm = _vllm_engine_dict[engine_key]
+    if "Qwen" in model_name:
+        sampling_params = SamplingParams(temperature=temperature, max_tokens=131072)
+    else:
+        sampling_params = SamplingParams(temperature=temperature, max_tokens=128000, stop_token_ids=[tokenizer.eos_token_id])
+    return tokenizer, llm, sampling_params
+
+
+def load_paper_content(paper_path, paper_format):
+    """Read the paper (JSON or LaTeX) once per process."""
+    paper_key = (os.path.abspath(paper_path), paper_format)
+    if paper_key not in _paper_content_dict:
+        with open(f'{paper_path}') as f:
+            if paper_format == "JSON":
+                _paper_content_dict[paper_key] = json.load(f)
+            else:
+                _paper_content_dict[paper_key] = f.read()
+    return _paper_content_dict[paper_key]
+
+
+def write_pages_jsonl(pages, jsonl_path):
+    """Write each page dict of `pages` (an iterable) as one JSON line as soon as it arrives; return the count."""
+    n_pages = 0
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for page in pages:
+            f.write(json.dumps(page) + "\n")
+            f.flush()  # a crash keeps every page written so far
+            n_pages += 1
+    return n_pages
+
+
+def read_pages_jsonl(jsonl_path, first_page=1, last_page=None):
+    """Lazily yield the pages `first_page`..`last_page` (1-based, inclusive) of a pages JSONL file.
+
+    Line n holds page n, so earlier lines are skipped without parsing, and reading stops
+    after `last_page`. A truncated last line (an interrupted extraction) is ignored.
+    """
+    with open(jsonl_path, encoding='utf-8') as f:
+        for page_num, line in enumerate(f, start=1):
+            if page_num < first_page:
+                continue
+            if last_page is not None and page_num > last_page:
+                return
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                return
+
+
+def get_checkpoint_key(model_name, msg, **params):
+    """Hash everything a unit of work depends on: model, messages (paper, prompt template,
+    upstream artifacts) and sampling parameters."""
+    payload = json.dumps({"model": model_name, "messages": msg, "params": params}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_checkpoint(output_dir, checkpoint_key):
+    checkpoint_path = f"{output_dir}/checkpoints/{checkpoint_key}.json"
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, encoding="utf-8") as f:
+        return json.load(f)["result"]
+
+
+def save_checkpoint(output_dir, checkpoint_key, result):
+    os.makedirs(f"{output_dir}/checkpoints", exist_ok=True)
+    checkpoint_path = f"{output_dir}/checkpoints/{checkpoint_key}.json"
+    # write-then-rename, so a crash never leaves a truncated checkpoint behind
+    with open(f"{checkpoint_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"result": result}, f)
+    os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+
+def run_with_checkpoint(output_dir, checkpoint_key, call_fn):
+    """Return (result, is_resumed); `call_fn()` only runs if no result is stored for the key."""
+    result = load_checkpoint(output_dir, checkpoint_key)
+    if result is not None:
+        return result, True
+    result = call_fn()
+    save_checkpoint(output_dir, checkpoint_key, result)
+    return result, False
+
+
+def run_batch_with_checkpoint(output_dir, checkpoint_key_lst, msg_lst, batch_fn):
+    """Like run_with_checkpoint for a batch: `batch_fn` only receives the messages without a stored result."""
+    result_lst = [load_checkpoint(output_dir, checkpoint_key) for checkpoint_key in checkpoint_key_lst]
+    todo_idx_lst = [idx for idx, result in enumerate(result_lst) if result is None]
+    if len(todo_idx_lst) > 0:
+        new_result_lst = batch_fn([msg_lst[idx] for idx in todo_idx_lst])
+        for idx, result in zip(todo_idx_lst, new_result_lst):
+            save_checkpoint(output_dir, checkpoint_key_lst[idx], result)
+            result_lst[idx] = result
+    if len(todo_idx_lst) < len(result_lst):
+        print(f"[RESUMED] {len(result_lst) - len(todo_idx_lst)}/{len(result_lst)} results loaded from checkpoints")
+    return result_lst
+
+
 def extract_planning(trajectories_json_file_path):
     with open(trajectories_json_file_path) as f:
         traj = json.load(f)
@@ -135,6 +275,348 @@ def extract_code_from_content2(content):
         print("[WARNING] No Python code found.")
     return extracted_code
 
+
+class ArtifactStream:
+    """Write a streamed completion to `path` as it arrives.
+
+    With `code_path`, the code of its first fenced block (as `extract_code_from_content`
+    finds it) is also written to `code_path` line by line, before the completion ends.
+    Both files are provisional: the stages rewrite them from the final completion.
+    """
+
+    def __init__(self, path, code_path=None):
+        for file_path in [path, code_path]:
+            if file_path and os.path.dirname(file_path):
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.f = open(path, 'w', encoding='utf-8')
+        self.code_f = open(code_path, 'w', encoding='utf-8') if code_path else None
+        self.code_state = "before"  # before -> code -> done
+        self.line = ""
+
+    def write(self, text):
+        self.f.write(text)
+        self.f.flush()
+        if self.code_f is None or self.code_state == "done":
+            return
+        self.line += text
+        *line_lst, self.line = self.line.split("\n")
+        for line in line_lst:
+            if self.code_state == "before":
+                if re.match(r'^```\w*\s*$', line):
+                    self.code_state = "code"
+            elif line.startswith("```"):
+                self.code_state = "done"
+                break
+            else:
+                self.code_f.write(line + "\n")
+        self.code_f.flush()
+
+    def close(self):
+        self.f.close()
+        if self.code_f is not None:
+            self.code_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stream_chat_completion(client, request, on_text=None):
+    """Send a chat completion request with `stream=True` and return it like `completion.model_dump()`.
+
+    `on_text(text)` is called with each piece of content as it arrives. The usage comes with
+    the last chunk (`stream_options.include_usage`), so cost logging works as for a non-streamed call.
+    """
+    stream = client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+    completion_json = {}
+    content_lst = []
+    finish_reason = None
+    for chunk in stream:
+        chunk_json = json.loads(chunk.model_dump_json())
+        if not completion_json:
+            completion_json = {"id": chunk_json["id"], "object": "chat.completion", "created": chunk_json["created"],
+                               "model": chunk_json["model"], "system_fingerprint": chunk_json.get("system_fingerprint")}
+        if chunk_json.get("usage"):
+            completion_json["usage"] = chunk_json["usage"]
+        for choice in chunk_json.get("choices") or []:
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                content_lst.append(content)
+                if on_text is not None:
+                    on_text(content)
+            finish_reason = choice.get("finish_reason") or finish_reason
+
+    message = {"role": "assistant", "content": "".join(content_lst)}
+    completion_json["choices"] = [{"index": 0, "message": message, "finish_reason": finish_reason}]
+    return completion_json
+
+
+def get_module_name(file_name):
+    # "src/models/model.py" -> "src.models.model"
+    module_name = os.path.splitext(file_name)[0]
+    return module_name.replace("/", ".")
+
+
+def extract_imported_modules(code):
+    """Return the module names imported by a piece of Python code (empty if it does not parse)."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.module:
+                modules.append(node.module)
+                # `from package import module` imports a submodule
+                modules.extend(f"{node.module}.{alias.name}" for alias in node.names)
+            else:
+                # `from . import module`
+                modules.extend(alias.name for alias in node.names)
+    return modules
+
+
+def match_modules_to_files(module_names, file_lst):
+    """Map imported module names onto files of the generated repository."""
+    matched_files = []
+    for file_name in file_lst:
+        if not file_name.endswith(".py"):
+            continue
+        module_name = get_module_name(file_name)
+        short_name = module_name.split(".")[-1]
+        for imported in module_names:
+            # absolute import, or an import relative to the file's package
+            if imported == module_name or module_name.endswith(f".{imported}") or imported == short_name:
+                matched_files.append(file_name)
+                break
+    return matched_files
+
+
+def get_mentioned_files(text, file_lst):
+    """Return the files of `file_lst` that `text` refers to by path, file name or import statement."""
+    mentioned_files = set()
+    for file_name in file_lst:
+        for name in {file_name, os.path.basename(file_name)}:
+            if re.search(rf"(?<![\w/.]){re.escape(name)}(?!\w)", text):
+                mentioned_files.add(file_name)
+
+    mentioned_modules = re.findall(r"(?:from|import)\s+([\w.]+)", text)
+    mentioned_files.update(match_modules_to_files(mentioned_modules, file_lst))
+    return [file_name for file_name in file_lst if file_name in mentioned_files]
+
+
+def build_dependency_graph(todo_file_lst, logic_analysis_dict, done_file_dict=None):
+    """Build {file: [files it depends on]} from the Logic Analysis and already generated code.
+
+    A file depends on another file of the task list when its logic analysis mentions that
+    file (e.g. "model.py") or imports its module, or when its generated code imports it.
+    Only files that come earlier in the task list are kept as dependencies: the planner
+    orders the task list by dependency, and this keeps the graph acyclic.
+    """
+    done_file_dict = done_file_dict or {}
+    dependency_graph = {}
+
+    for todo_idx, todo_file_name in enumerate(todo_file_lst):
+        prev_file_lst = [f for f in todo_file_lst[:todo_idx] if f != todo_file_name and f != "config.yaml"]
+        desc = logic_analysis_dict.get(todo_file_name, "")
+        if not isinstance(desc, str):
+            desc = str(desc)
+
+        dependencies = set(get_mentioned_files(desc, prev_file_lst))
+
+        if todo_file_name in done_file_dict:
+            imported_modules = extract_imported_modules(done_file_dict[todo_file_name])
+            dependencies.update(match_modules_to_files(imported_modules, prev_file_lst))
+
+        # keep the task list order for a stable prompt/schedule
+        dependency_graph[todo_file_name] = [f for f in prev_file_lst if f in dependencies]
+
+    return dependency_graph
+
+
+def load_generated_code(output_repo_dir, file_lst):
+    """Return {file: code} for the files of `file_lst` an earlier (resumed) run already wrote."""
+    code_dict = {}
+    if not output_repo_dir:
+        return code_dict
+    for file_name in file_lst:
+        path = os.path.join(output_repo_dir, file_name)
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                code_dict[file_name] = f.read()
+    return code_dict
+
+
+def get_dependency_levels(dependency_graph):
+    """Group files into waves; every file only depends on files of earlier waves."""
+    level_dict = {}
+    for file_name in dependency_graph:
+        # dependencies always come earlier in the task list, so a single pass is enough
+        level_dict[file_name] = 1 + max([level_dict.get(dep, -1) for dep in dependency_graph[file_name]], default=-1)
+
+    levels = []
+    for file_name, level in level_dict.items():
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(file_name)
+    return levels
+
+
+def run_in_waves(levels, build_msg, batch_generate, on_done):
+    """Generate files level by level, submitting each level as a single batch.
+
+    `build_msg(file_name)` is called once every earlier level is done, so the prompt can
+    include the files generated before; `batch_generate(msg_lst)` returns one completion
+    per message; `on_done(file_name, msg, completion)` stores the result.
+    """
+    for level_idx, level in enumerate(levels):
+        print(f"[WAVE {level_idx + 1}/{len(levels)}] {level}")
+        msg_lst = [build_msg(file_name) for file_name in level]
+        completion_lst = batch_generate(msg_lst)
+        for file_name, msg, completion in zip(level, msg_lst, completion_lst):
+            on_done(file_name, msg, completion)
+
+
+def extract_design_relations(design):
+    """Return {class name: set of related class names} from a mermaid classDiagram.
+
+    Relations such as `Trainer --> Model` or `Model "1" *-- "n" Layer` are treated as undirected.
+    """
+    relation_dict = {}
+    for class_name in re.findall(r"^\s*class\s+(\w+)", design, re.MULTILINE):
+        relation_dict.setdefault(class_name, set())
+
+    pattern = r'^\s*(\w+)\s+(?:"[^"]*"\s+)?[<>|*o.\-]{2,}\s+(?:"[^"]*"\s+)?(\w+)'
+    for src, dst in re.findall(pattern, design, re.MULTILINE):
+        relation_dict.setdefault(src, set()).add(dst)
+        relation_dict.setdefault(dst, set()).add(src)
+    return relation_dict
+
+
+def get_defined_names(code):
+    """Return the top-level class and function names defined in a piece of Python code."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+    return [node.name for node in tree.body if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef))]
+
+
+_stub_cache = {}
+
+def code_to_stub(code):
+    """Return the public interface of a piece of Python code as a compact stub.
+
+    Imports, module constants, classes, signatures (with type hints), docstrings and the
+    attributes assigned in `__init__` are kept; every function body is elided. Stubs are
+    cached by the content hash of `code`. Code that does not parse is returned unchanged.
+    """
+    code_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    if code_hash in _stub_cache:
+        return _stub_cache[code_hash]
+
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code
+
+    def get_docstring(body):
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+            return [body[0]]
+        return []
+
+    def stub_function(node):
+        body = get_docstring(node.body)
+        if node.name == "__init__":
+            # instance attributes are part of the interface: `self.dim = ...`
+            for stmt in node.body:
+                if isinstance(stmt, ast.Assign):
+                    targets = [t for t in stmt.targets if isinstance(t, ast.Attribute) and isinstance(t.value, ast.Name) and t.value.id == "self"]
+                    if targets:
+                        stmt.targets, stmt.value = targets, ast.Constant(...)
+                        body.append(stmt)
+                elif isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Attribute):
+                    stmt.value = None
+                    body.append(stmt)
+        node.body = body or [ast.Expr(ast.Constant(...))]
+        return node
+
+    def stub_assign(node):
+        # keep short values (defaults, constants), elide long literals
+        if node.value is not None and len(ast.unparse(node.value)) > 80:
+            node.value = ast.Constant(...)
+        return node
+
+    def stub_body(body, is_module):
+        stubbed = get_docstring(body)
+        for node in body[len(stubbed):]:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                stubbed.append(stub_function(node))
+            elif isinstance(node, ast.ClassDef):
+                node.body = stub_body(node.body, is_module=False) or [ast.Expr(ast.Constant(...))]
+                stubbed.append(node)
+            elif isinstance(node, (ast.AnnAssign, ast.Assign)):
+                stubbed.append(stub_assign(node))
+            elif is_module and isinstance(node, (ast.Import, ast.ImportFrom)):
+                stubbed.append(node)
+        return stubbed
+
+    tree.body = stub_body(tree.body, is_module=True)
+    stub = ast.unparse(tree)
+    _stub_cache[code_hash] = stub
+    return stub
+
+
+def select_code_context(todo_file_name, done_file_lst, done_file_dict, reference_text, dependency_graph=None, design_relations=None):
+    """Split the generated files into the ones `todo_file_name` uses and the rest.
+
+    A file is relevant when it is a dependency in `dependency_graph`, when `reference_text`
+    (the logic analysis of the target file) mentions it or one of the classes/functions it
+    defines, or when it defines a class that the design relates to a class of the target file.
+    Files that the generated code of a relevant file imports are relevant as well, since the
+    target file will call into them through it.
+    Returns (relevant_file_lst, other_file_lst), both in generation order.
+    """
+    dependency_graph = dependency_graph or {}
+    design_relations = design_relations or {}
+    code_file_lst = [f for f in done_file_lst if f in done_file_dict and not f.endswith(".yaml")]
+
+    relevant_files = set(dependency_graph.get(todo_file_name, []))
+    relevant_files.update(get_mentioned_files(reference_text, code_file_lst))
+
+    defined_name_dict = {f: get_defined_names(done_file_dict[f]) for f in code_file_lst}
+    defined_names = {name for names in defined_name_dict.values() for name in names}
+    mentioned_names = {name for name in defined_names | set(design_relations)
+                       if re.search(rf"\b{re.escape(name)}\b", reference_text)}
+
+    # classes of the target file itself are not generated yet; pull in what the design relates them to
+    referenced_names = set(mentioned_names)
+    for name in mentioned_names - defined_names:
+        referenced_names.update(design_relations.get(name, set()))
+
+    for file_name, names in defined_name_dict.items():
+        if referenced_names.intersection(names):
+            relevant_files.add(file_name)
+
+    # follow the AST imports of the selected files through the generated code
+    pending_file_lst = [f for f in code_file_lst if f in relevant_files]
+    while pending_file_lst:
+        imported_modules = extract_imported_modules(done_file_dict[pending_file_lst.pop()])
+        for file_name in match_modules_to_files(imported_modules, code_file_lst):
+            if file_name not in relevant_files:
+                relevant_files.add(file_name)
+                pending_file_lst.append(file_name)
+
+    relevant_file_lst = [f for f in code_file_lst if f in relevant_files]
+    other_file_lst = [f for f in code_file_lst if f not in relevant_files]
+    return relevant_file_lst, other_file_lst
+
+
 def format_json_data(data):
     formatted_text = ""
     for key, value in data.items():
@@ -264,17 +746,27 @@ def cal_cost(response_json, model_name):
         'total_cost': total_cost,
     }
 
-def load_accumulated_cost(accumulated_cost_file):
-    if os.path.exists(accumulated_cost_file):
-        with open(accumulated_cost_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data.get("total_cost", 0.0)
-    else:
-        return 0.0
-
-def save_accumulated_cost(accumulated_cost_file, cost):
+def load_stage_costs(accumulated_cost_file):
+    if not os.path.exists(accumulated_cost_file):
+        return {}
+    with open(accumulated_cost_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if "stages" in data:
+        return data["stages"]
+    # written before costs were kept per stage
+    return {"previous": data.get("total_cost", 0.0)}
+
+def load_accumulated_cost(accumulated_cost_file, exclude_stage=None):
+    """Sum of the per-stage costs, without `exclude_stage` (the stage about to rewrite its entry)."""
+    stage_cost_dict = load_stage_costs(accumulated_cost_file)
+    return sum(cost for stage, cost in stage_cost_dict.items() if stage != exclude_stage)
+
+def save_accumulated_cost(accumulated_cost_file, stage, cost):
+    """Replace the cost of `stage`, so rerunning a stage does not count it twice."""
+    stage_cost_dict = load_stage_costs(accumulated_cost_file)
+    stage_cost_dict[stage] = cost
     with open(accumulated_cost_file, "w", encoding="utf-8") as f:
-        json.dump({"total_cost": cost}, f)
+        json.dump({"stages": stage_cost_dict, "total_cost": sum(stage_cost_dict.values())}, f)
 
 def print_response(completion_json, is_llm=False):
     print("============================================")
@@ -296,6 +788,7 @@ def print_log_cost(completion_json, gpt_version, current_stage, output_dir, tota
     output_lines.append(f"🛠️ Model: {usage_info['model_name']}")
     output_lines.append(f"📥 Input tokens: {usage_info['actual_input_tokens']} (Cost: ${usage_info['input_cost']:.8f})")
     output_lines.append(f"📦 Cached input tokens: {usage_info['cached_tokens']} (Cost: ${usage_info['cached_input_cost']:.8f})")
+    output_lines.append(f"♻️ Cache hit ratio: {get_cache_hit_ratio(usage_info['actual_input_tokens'], usage_info['cached_tokens']):.2%}")
     output_lines.append(f"📤 Output tokens: {usage_info['output_tokens']} (Cost: ${usage_info['output_cost']:.8f})")
     output_lines.append(f"💵 Current total cost: ${current_cost:.8f}")
     output_lines.append(f"🪙 Accumulated total cost so far: ${total_accumulated_cost:.8f}")
@@ -307,10 +800,61 @@ def print_log_cost(completion_json, gpt_version, current_stage, output_dir, tota
 
     with open(f"{output_dir}/cost_info.log", "a", encoding="utf-8") as f:
         f.write(output_text + "\n")
+
+    # machine-readable copy, used by load_usage_summary
+    with open(f"{output_dir}/usage_log.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"stage": current_stage, **usage_info}) + "\n")
     
     return total_accumulated_cost
 
 
+def get_cache_hit_ratio(actual_input_tokens, cached_tokens):
+    prompt_tokens = actual_input_tokens + cached_tokens
+    return cached_tokens / prompt_tokens if prompt_tokens > 0 else 0.0
+
+
+def print_log_cache_summary(completion_json_lst, current_stage, output_dir):
+    """Log the prompt cache hit ratio over all calls of a stage."""
+    prompt_tokens = sum(completion_json["usage"]["prompt_tokens"] for completion_json in completion_json_lst)
+    cached_tokens = sum(((completion_json["usage"].get("prompt_tokens_details") or {}).get("cached_tokens") or 0) for completion_json in completion_json_lst)
+
+    output_lines = []
+    output_lines.append("🌟 Prompt Cache Summary 🌟")
+    output_lines.append(f"{current_stage}")
+    output_lines.append(f"📨 Calls: {len(completion_json_lst)}")
+    output_lines.append(f"📥 Prompt tokens: {prompt_tokens}")
+    output_lines.append(f"📦 Cached input tokens: {cached_tokens}")
+    output_lines.append(f"♻️ Cache hit ratio: {get_cache_hit_ratio(prompt_tokens - cached_tokens, cached_tokens):.2%}")
+    output_lines.append("============================================\n")
+
+    output_text = "\n".join(output_lines)
+
+    print(output_text)
+
+    with open(f"{output_dir}/cost_info.log", "a", encoding="utf-8") as f:
+        f.write(output_text + "\n")
+
+
+def load_usage_summary(output_dir):
+    """Sum the token usage and cost of every call logged by print_log_cost in `output_dir`."""
+    summary = {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "total_cost": 0.0}
+    usage_log_path = f"{output_dir}/usage_log.jsonl"
+    if not os.path.exists(usage_log_path):
+        return summary
+
+    with open(usage_log_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            usage_info = json.loads(line)
+            summary["calls"] += 1
+            summary["input_tokens"] += usage_info["actual_input_tokens"] + usage_info["cached_tokens"]
+            summary["cached_tokens"] += usage_info["cached_tokens"]
+            summary["output_tokens"] += usage_info["output_tokens"]
+            summary["total_cost"] += usage_info["total_cost"]
+    return summary
+
+
 def num_tokens_from_messages(messages, model="gpt-4o-2024-08-06"):
     import tiktoken
     
@@ -0,0 +1,64 @@
+"""Micro-benchmark for `choose_model`.
+
+Compares the compiled routing table with the previous implementation, which re-split
+every pattern on each call. Run from the repository root:
+
+    python -m llm_router.benchmark_routing
+"""
+
+import argparse
+import time
+
+from llm_router import router
+
+
+def choose_model_uncompiled(task, *, tokens=0):
+    # previous implementation, kept for comparison (substring match, parsed on every call)
+    for pattern, rule in router._load_cfg()["routing_rules"].items():
+        name, *cond = pattern.split(">")
+        if name in task:
+            if cond and tokens <= router._parse_tokens(cond[0]):
+                continue
+            return rule["primary"]
+    raise ValueError("No routing rule found")
+
+
+def bench(fn, calls, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        for task, tokens in calls:
+            try:
+                fn(task, tokens=tokens)
+            except ValueError:
+                pass
+    return (time.perf_counter() - start) / (n * len(calls))
+
+
+def main(args):
+    calls = [("rag", 2_000), ("code", 8_000), ("tool_reasoning", 500), ("long_doc", 400_000), ("unknown", 0)]
+    router._routing_table()  # compile once, as at first call
+
+    print(f"{'task':<16} {'tokens':>8}  {'compiled':<18} {'uncompiled':<18}")
+    for task, tokens in calls:
+        results = []
+        for fn in (router.choose_model, choose_model_uncompiled):
+            try:
+                results.append(fn(task, tokens=tokens))
+            except ValueError:
+                results.append("-")
+        print(f"{task:<16} {tokens:>8}  {results[0]:<18} {results[1]:<18}")
+
+    compiled = bench(router.choose_model, calls, args.n)
+    uncompiled = bench(choose_model_uncompiled, calls, args.n)
+    print("============================================")
+    print(f"⏱️ Compiled: {compiled * 1e9:.0f} ns/call")
+    print(f"⏱️ Uncompiled: {uncompiled * 1e9:.0f} ns/call")
+    print(f"🚀 Speedup: {uncompiled / compiled:.1f}x")
+    print("============================================")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100_000) # rounds over the sample calls
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,115 @@
+"""Disk-backed response cache for deterministic router calls.
+
+Responses of `temperature=0` calls are stored under `{dir}/{key[:2]}/{key}.pkl`, where the
+key is a SHA-256 of the model, the normalized prompt and the call parameters. Image parts
+are hashed by their pixel data, so re-running the same PDF hits the cache page by page.
+The directory is kept under `max_bytes` by evicting the least recently used entries.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+
+def _normalize(prompt):
+    if isinstance(prompt, str):
+        return "\n".join(line.rstrip() for line in prompt.replace("\r\n", "\n").strip().split("\n"))
+    if isinstance(prompt, dict):
+        return {str(key): _normalize(value) for key, value in prompt.items()}
+    if isinstance(prompt, (list, tuple)):
+        return [_normalize(item) for item in prompt]
+    if isinstance(prompt, (bytes, bytearray)):
+        return {"bytes_sha256": hashlib.sha256(prompt).hexdigest()}
+    if hasattr(prompt, "tobytes") and hasattr(prompt, "mode"):  # PIL.Image
+        return {"image_sha256": hashlib.sha256(prompt.tobytes()).hexdigest(), "size": list(prompt.size), "mode": prompt.mode}
+    if prompt is None or isinstance(prompt, (int, float, bool)):
+        return prompt
+    return repr(prompt)
+
+
+def request_key(**payload):
+    """SHA-256 of the normalized `payload`, e.g. a model, prompt and call parameters."""
+    return hashlib.sha256(json.dumps(_normalize(payload), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def is_deterministic(params):
+    """Only greedy, single-choice, non-streaming calls are cached."""
+    return params.get("temperature") == 0 and params.get("n", 1) == 1 and not params.get("stream")
+
+
+class ResponseCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sizes = None  # path -> size, scanned from disk on first write
+        self._lock = threading.Lock()
+
+    def key(self, model_id, prompt, params):
+        return request_key(model=model_id, prompt=prompt, params=params)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def lookup(self, key_lst):
+        """Return the first cached response among `key_lst` (e.g. one per model of a fallback chain), or None."""
+        for key in key_lst:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    response = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            os.utime(path)  # mtime marks the last use for LRU eviction
+            with self._lock:
+                self.hits += 1
+            return response
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, response):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename, so concurrent readers never see a truncated entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(response, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            sizes = self._scan() if self._sizes is None else self._sizes
+            sizes[path] = os.path.getsize(path)
+            if sum(sizes.values()) > self.max_bytes:
+                self._evict(sizes)
+
+    def _scan(self):
+        self._sizes = {}
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                if file_name.endswith(".pkl"):
+                    path = os.path.join(root, file_name)
+                    self._sizes[path] = os.path.getsize(path)
+        return self._sizes
+
+    def _evict(self, sizes):
+        # drop least recently used entries until the cache is at 90% of its limit
+        total = sum(sizes.values())
+        for path in sorted(sizes, key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0):
+            if total <= 0.9 * self.max_bytes:
+                break
+            total -= sizes.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            sizes = self._scan() if self._sizes is None else self._sizes
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(sizes), "bytes": sum(sizes.values())}
@@ -0,0 +1,62 @@
+"""Per-model health tracking for the router.
+
+A model's circuit opens after `failure_threshold` consecutive failed calls. While it is
+open the router skips the model instead of spending retries and wall time on it. After
+`cooldown_sec` one trial call is let through (half-open): success closes the circuit,
+failure opens it for another cooldown.
+"""
+
+import threading
+import time
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown_sec=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown_sec = cooldown_sec
+        self.clock = clock
+        self._failures = {}
+        self._opened_at = {}
+        self._trial = set()  # models with a half-open trial call in flight
+        self._lock = threading.Lock()
+
+    def state(self, model_id):
+        opened_at = self._opened_at.get(model_id)
+        if opened_at is None:
+            return "closed"
+        if self.clock() - opened_at < self.cooldown_sec:
+            return "open"
+        return "half_open"
+
+    def allow(self, model_id):
+        """Whether a call to `model_id` should be attempted now."""
+        with self._lock:
+            state = self.state(model_id)
+            if state == "closed":
+                return True
+            if state == "half_open" and model_id not in self._trial:
+                self._trial.add(model_id)
+                return True
+            return False
+
+    def record_success(self, model_id):
+        with self._lock:
+            self._failures.pop(model_id, None)
+            self._opened_at.pop(model_id, None)
+            self._trial.discard(model_id)
+
+    def release_trial(self, model_id):
+        """End a half-open trial without a verdict (e.g. the call was cancelled or throttled)."""
+        with self._lock:
+            self._trial.discard(model_id)
+
+    def record_failure(self, model_id):
+        with self._lock:
+            self._failures[model_id] = self._failures.get(model_id, 0) + 1
+            if model_id in self._trial or self._failures[model_id] >= self.failure_threshold:
+                self._opened_at[model_id] = self.clock()
+            self._trial.discard(model_id)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when every model that could serve a call has an open circuit."""
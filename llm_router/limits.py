@@ -0,0 +1,103 @@
+"""Per-provider rate limits for the router.
+
+Each provider gets requests-per-minute and tokens-per-minute token buckets and an
+AIMD (additive increase, multiplicative decrease) concurrency limit: every rate-limit
+response halves the number of requests allowed in flight, and every success adds
+about one request per round of successes, up to `max_concurrency`. Throughput then
+settles just below the provider's limit instead of bursting into 429s.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_sec=10, clock=time.monotonic):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_sec)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """Take `amount` tokens and return how many seconds the caller must wait before using them."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+
+class ProviderLimiter:
+    def __init__(self, max_concurrency, rpm=None, tpm=None, min_concurrency=1, decrease=0.5,
+                 cooldown_sec=1.0, clock=time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease = decrease
+        self.cooldown_sec = cooldown_sec  # one burst of 429s only backs off once
+        self.clock = clock
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.rate_limited = 0
+        self._rpm = TokenBucket(rpm, clock=clock) if rpm else None
+        self._tpm = TokenBucket(tpm, clock=clock) if tpm else None
+        self._last_decrease = float("-inf")
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+    def reserve(self, tokens):
+        """Seconds to wait before sending a request of `tokens` tokens under the rpm/tpm limits."""
+        delay = self._rpm.reserve(1) if self._rpm else 0.0
+        if self._tpm:
+            delay = max(delay, self._tpm.reserve(tokens))
+        return delay
+
+    def _try_acquire(self):
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self):
+        with self._cond:
+            while not self._try_acquire():
+                self._cond.wait()
+
+    async def acquire_async(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._try_acquire():
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, outcome="ok"):
+        """Free a slot; `outcome` is "ok" (grow the limit), "rate_limited" (shrink it) or "error"."""
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == "rate_limited":
+                self.rate_limited += 1
+                now = self.clock()
+                if now - self._last_decrease >= self.cooldown_sec:
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease)
+                    self._last_decrease = now
+            elif outcome == "ok":
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+            for loop, waiter in self._async_waiters:
+                loop.call_soon_threadsafe(_wake, waiter)
+            self._async_waiters.clear()
+
+    def stats(self):
+        with self._cond:
+            return {"limit": self.limit, "in_flight": self.in_flight, "rate_limited": self.rate_limited}
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -1,7 +1,21 @@
+import asyncio
 import os
+import random
+import threading
+import time
+import weakref
 import yaml
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from functools import lru_cache
 
+from llm_router.cache import ResponseCache, is_deterministic, request_key
+from llm_router.health import CircuitBreaker, CircuitOpenError
+from llm_router.limits import ProviderLimiter
+from llm_router.singleflight import SingleFlight
+from llm_router.stats import HedgeBudget, latency_stats
+from llm_router.tokens import count_prompt_tokens
+
 CONFIG_PATH = os.environ.get("LLM_CFG", "llm_router/config.yaml")
 
 @lru_cache
@@ -9,40 +23,671 @@ def _load_cfg():
     with open(CONFIG_PATH) as f:
         return yaml.safe_load(f)
 
-def choose_model(task: str, *, tokens: int = 0):
-    cfg = _load_cfg()
-    rules = cfg["routing_rules"]
+def reload_config():
+    """Drop the cached config and routing table, e.g. after changing `CONFIG_PATH`."""
+    _load_cfg.cache_clear()
+    _routing_table.cache_clear()
+    _circuit_breaker.cache_clear()
+    hedge_budget.cache_clear()
+    response_cache.cache_clear()
+    single_flight.cache_clear()
+    provider_limiter.cache_clear()
 
-    for pattern, rule in rules.items():
-        name, *cond = pattern.split(">")
-        if name in task:
-            if cond and tokens <= int(cond[0]):   # long_doc
-                continue
-            return rule["primary"]
-    raise ValueError("No routing rule found")
+def _parse_tokens(value):
+    value = str(value).strip().lower().replace("_", "")
+    for suffix, scale in (("k", 1_000), ("m", 1_000_000)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * scale)
+    return int(value)
+
+@lru_cache
+def _routing_table():
+    """Compile `routing_rules` into {task: (thresholds, rules)}, with `fallback` as a list.
+
+    A pattern is `alt1|alt2|...` optionally followed by `>N` (e.g. `long_doc>300k`), which
+    only applies when the prompt has more than N tokens. Thresholds are sorted ascending,
+    and rules without a threshold use -inf, so lookup is a dict hit plus a bisect.
+    """
+    bands = {}
+    for pattern, rule in _load_cfg()["routing_rules"].items():
+        names, *cond = pattern.split(">")
+        threshold = _parse_tokens(cond[0]) if cond else float("-inf")
+        # `fallback` is one model or an ordered chain of models
+        fallback = rule.get("fallback") or []
+        rule = {**rule, "fallback": [fallback] if isinstance(fallback, str) else list(fallback)}
+        for name in names.split("|"):
+            name = name.strip()
+            if any(t == threshold for t, _ in bands.get(name, [])):
+                raise ValueError(f"Duplicate routing rule for '{name}' in '{pattern}'")
+            bands.setdefault(name, []).append((threshold, rule))
+
+    table = {}
+    for name, band_lst in bands.items():
+        band_lst.sort(key=lambda band: band[0])
+        table[name] = ([band[0] for band in band_lst], [band[1] for band in band_lst])
+    return table
+
+def _match_rule(task, tokens=0):
+    entry = _routing_table().get(task)
+    if entry is not None:
+        thresholds, rules = entry
+        # the highest threshold strictly below `tokens`
+        idx = bisect_left(thresholds, tokens) - 1
+        if idx >= 0:
+            return rules[idx]
+    raise ValueError(f"No routing rule found for task '{task}' ({tokens} tokens)")
+
+def _model_cfg(model_id):
+    return _load_cfg().get("models", {}).get(model_id, {})
+
+def _predicted_latency(model_id, output_tokens):
+    speed_tps = _model_cfg(model_id).get("speed_tps")
+    return output_tokens / speed_tps if speed_tps else None
+
+def estimate_call(model_id, tokens, output_tokens=None):
+    """Return the (cost in $, latency in s) of a call, from config metadata refined by observed latencies."""
+    output_tokens = output_tokens or _load_cfg()["defaults"].get("expected_output_tokens", 1000)
+    cost = _model_cfg(model_id).get("price_per_mtok", 0) * (tokens + output_tokens) / 1_000_000
+    predicted = _predicted_latency(model_id, output_tokens)
+    latency = predicted * latency_stats.correction(model_id) if predicted else float("inf")
+    return cost, latency
+
+def rank_models(task, *, tokens=0, optimize="cost", max_cost=None, max_latency=None, output_tokens=None):
+    """Return the task's candidate models that fit `tokens` and the constraints, best first.
+
+    Candidates are the rule's `candidates` list, or its primary and fallback chain. `optimize` is
+    "cost" (cheapest first, ties broken by latency) or "latency" (fastest first).
+    """
+    if optimize not in ("cost", "latency"):
+        raise ValueError(f"Unknown optimize mode '{optimize}', expected 'cost' or 'latency'")
+    rule = _match_rule(task, tokens)
+    ranked = []
+    for m_id in rule.get("candidates") or [rule["primary"], *rule["fallback"]]:
+        context = _model_cfg(m_id).get("context")
+        if context is not None and tokens > context:
+            continue
+        cost, latency = estimate_call(m_id, tokens, output_tokens)
+        if (max_cost is not None and cost > max_cost) or (max_latency is not None and latency > max_latency):
+            continue
+        ranked.append((cost, latency, m_id) if optimize == "cost" else (latency, cost, m_id))
+    return [m_id for *_, m_id in sorted(ranked)]
+
+def choose_model(task: str, *, tokens: int = 0, optimize=None, max_cost=None, max_latency=None):
+    if optimize is None:
+        return _match_rule(task, tokens)["primary"]
+    m_lst = rank_models(task, tokens=tokens, optimize=optimize, max_cost=max_cost, max_latency=max_latency)
+    if not m_lst:
+        raise ValueError(f"No model for task '{task}' satisfies max_cost={max_cost}, max_latency={max_latency}")
+    return m_lst[0]
+
+def _tokenizer_family(model_id):
+    return _model_cfg(model_id).get("tokenizer", _provider(model_id))
+
+def _fits_context(model_id, prompt):
+    context = _model_cfg(model_id).get("context")
+    return context is None or count_prompt_tokens(prompt, _tokenizer_family(model_id)) <= context
+
+def _route(task, prompt, optimize=None, max_cost=None, max_latency=None):
+    """Return the models to try for a prompt in order, skipping those whose context it exceeds."""
+    tokens = count_prompt_tokens(prompt)
+    if optimize is None:
+        rule = _match_rule(task, tokens)
+        m_lst = [rule["primary"], *rule["fallback"]]
+    else:
+        m_lst = rank_models(task, tokens=tokens, optimize=optimize, max_cost=max_cost, max_latency=max_latency)
+    m_lst = [m_id for m_id in dict.fromkeys(m_lst) if _fits_context(m_id, prompt)]
+    if not m_lst:
+        raise ValueError(f"No model for task '{task}' fits the prompt ({tokens} tokens) and constraints")
+    return m_lst
+
+@lru_cache
+def _circuit_breaker():
+    breaker_cfg = _load_cfg()["defaults"].get("circuit_breaker") or {}
+    return CircuitBreaker(breaker_cfg.get("failure_threshold", 5), breaker_cfg.get("cooldown_sec", 30))
+
+def _is_retryable(error):
+    # client errors (bad request, auth, ...) fail the same way on every model, except
+    # timeouts, conflicts and rate limits; errors without a status (network, timeout) are retried
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return not isinstance(status, int) or status in (408, 409, 429) or status >= 500
+
+def _attempts(m_lst):
+    """Yield (model, backoff in s) for the primary and up to `max_retry` retries over the fallback chain.
+
+    Models with an open circuit are skipped without using the retry budget. Backoff is
+    exponential with full jitter and only applies when retrying a model that already failed.
+    """
+    defaults = _load_cfg()["defaults"]
+    max_retry = defaults["max_retry"]
+    base, cap = defaults.get("backoff_base_sec", 0.5), defaults.get("backoff_max_sec", 8)
+    retry_lst = m_lst[1:] or m_lst
+    breaker = _circuit_breaker()
+
+    tried = {}
+    queue = [m_lst[0]] + [retry_lst[i % len(retry_lst)] for i in range(max_retry)]
+    for m_id in queue:
+        if not breaker.allow(m_id):
+            continue
+        n_failed = tried.get(m_id, 0)
+        tried[m_id] = n_failed + 1
+        yield m_id, random.uniform(0, min(cap, base * 2 ** (n_failed - 1))) if n_failed else 0.0
+    if not tried:
+        raise CircuitOpenError(f"Circuits of {', '.join(m_lst)} are open")
+
+@lru_cache
+def hedge_budget():
+    """The process-wide hedge budget; `calls`, `hedges` and `hedge_wins` count its use."""
+    hedge_cfg = _load_cfg().get("hedging") or {}
+    return HedgeBudget(hedge_cfg.get("budget", 0.1), hedge_cfg.get("burst", 5))
+
+@lru_cache
+def _hedge_executor():
+    return ThreadPoolExecutor(max_workers=(_load_cfg().get("hedging") or {}).get("max_workers", 64))
+
+@lru_cache
+def _timeout_executor():
+    # separate from the hedge pool, whose workers block on these calls
+    return ThreadPoolExecutor(max_workers=_load_cfg()["defaults"].get("max_concurrency", 16) * 4)
+
+def _hedge_delay(m_lst, m_id, hedge):
+    """Seconds to wait for `m_id` before hedging to the next model, or None to not hedge."""
+    hedge_cfg = _load_cfg().get("hedging") or {}
+    if not (hedge_cfg.get("enabled", False) if hedge is None else hedge):
+        return None
+    # only the first attempt is hedged, to a fallback that is healthy
+    if len(m_lst) < 2 or m_id != m_lst[0] or _circuit_breaker().state(m_lst[1]) != "closed":
+        return None
+    if latency_stats.count(m_id) < hedge_cfg.get("min_samples", 20):
+        return None
+    return latency_stats.percentile(m_id, hedge_cfg.get("percentile", 95))
 
-def wrap_call(task, prompt, **kw):
-    m_id = choose_model(task, tokens=len(str(prompt))//4)
+def _record_outcome(m_id, error=None):
+    breaker = _circuit_breaker()
+    if error is None or not _is_retryable(error):
+        breaker.record_success(m_id)  # the provider answered
+    elif _is_rate_limited(error):  # throttling is not a sign of an unhealthy model
+        breaker.release_trial(m_id)
+    else:
+        breaker.record_failure(m_id)
+
+def _tracked_call(m_id, prompt, **kw):
+    """`_call` that records the outcome in the model's circuit breaker."""
     try:
-        return _call(m_id, prompt, **kw)
+        response = _call(m_id, prompt, **kw)
     except Exception as e:
-        for _ in range(_load_cfg()["defaults"]["max_retry"]):
-            m_id = _load_cfg()["routing_rules"][task]["fallback"]
-            try:
-                return _call(m_id, prompt, **kw)
-            except Exception:
-                continue
-        raise e  # escalate
+        _record_outcome(m_id, e)
+        raise
+    except BaseException:
+        # cancelled (e.g. a losing hedge): no verdict, but free a half-open trial slot
+        _circuit_breaker().release_trial(m_id)
+        raise
+    _record_outcome(m_id)
+    return response
 
-def _call(model_id, prompt, **kw):
-    # Unified interface
+async def _tracked_call_async(m_id, prompt, **kw):
+    try:
+        response = await _call_async(m_id, prompt, **kw)
+    except Exception as e:
+        _record_outcome(m_id, e)
+        raise
+    except BaseException:
+        # cancelled (e.g. a losing hedge): no verdict, but free a half-open trial slot
+        _circuit_breaker().release_trial(m_id)
+        raise
+    _record_outcome(m_id)
+    return response
+
+def _hedged_call(m_id, hedge_id, delay, prompt, **kw):
+    """Call `m_id`; if it has not answered after `delay` s, also call `hedge_id`.
+
+    Returns (model that answered, response) for the first success. Each request records
+    its own outcome, so a failing primary still opens its circuit when the hedge wins.
+    """
+    budget = hedge_budget()
+    budget.record_call()
+    primary = _hedge_executor().submit(_tracked_call, m_id, prompt, **kw)
+    done, _ = wait([primary], timeout=delay)
+    if done or not budget.try_hedge():
+        return m_id, primary.result()
+    hedge = _hedge_executor().submit(_tracked_call, hedge_id, prompt, **kw)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    budget.record_win()
+                # a running thread cannot be cancelled: the slower call finishes in the background
+                return (hedge_id if future is hedge else m_id), future.result()
+    return m_id, primary.result()  # both failed: raise the primary's error
+
+async def _hedged_call_async(m_id, hedge_id, delay, prompt, **kw):
+    """Async version of `_hedged_call`; the slower request is cancelled."""
+    budget = hedge_budget()
+    budget.record_call()
+    start = time.perf_counter()
+    primary = asyncio.ensure_future(_tracked_call_async(m_id, prompt, **kw))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done or not budget.try_hedge():
+        return m_id, await primary
+    hedge = asyncio.ensure_future(_tracked_call_async(hedge_id, prompt, **kw))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for request in done:
+                if request.exception() is None:
+                    if request is hedge:
+                        budget.record_win()
+                    return (hedge_id if request is hedge else m_id), request.result()
+        return m_id, await primary  # both failed: raise the primary's error
+    finally:
+        for request in pending:
+            request.cancel()
+        if primary in pending:
+            # keep the slow tail in the latency stats, or the hedge delay would keep shrinking
+            latency_stats.record(m_id, time.perf_counter() - start)
+
+@lru_cache
+def response_cache():
+    """The on-disk response cache for deterministic calls, or None if `cache.enabled` is false."""
+    cache_cfg = _load_cfg().get("cache") or {}
+    if not cache_cfg.get("enabled", False):
+        return None
+    return ResponseCache(cache_cfg.get("dir", "~/.cache/paper2code/llm_router"), int(cache_cfg.get("max_size_mb", 1024) * 1024 * 1024))
+
+def _cache_keys(m_lst, prompt, kw):
+    cache = response_cache()
+    if cache is None or not is_deterministic(kw):
+        return None, {}
+    return cache, {m_id: cache.key(m_id, prompt, kw) for m_id in m_lst}
+
+@lru_cache
+def single_flight():
+    """Coalesces concurrent identical deterministic calls, or None if `singleflight.enabled` is false.
+
+    `single_flight().stats()` reports the upstream `calls` and how many calls were `coalesced`.
+    """
+    if not (_load_cfg().get("singleflight") or {}).get("enabled", True):
+        return None
+    return SingleFlight()
+
+def _flight_key(m_lst, prompt, hedge, kw):
+    # sampled calls are expected to differ, so only deterministic ones are shared
+    flights = single_flight()
+    if flights is None or not is_deterministic(kw):
+        return None, None
+    return flights, request_key(models=m_lst, prompt=prompt, hedge=hedge, params=kw)
+
+def wrap_call(task, prompt, *, optimize=None, max_cost=None, max_latency=None, hedge=None, **kw):
+    """Call the model routed for `task`, falling back on errors.
+
+    By default the rule's primary model is used, then its fallback chain. With
+    `optimize="cost"` or `"latency"` the candidates within `max_cost` ($) and
+    `max_latency` (s) are tried cheapest or fastest first instead.
+
+    With hedging (`hedge=True` or `hedging.enabled`), if the first model has not answered
+    within the `hedging.percentile` of its observed latency, the same request is also sent
+    to the next model and the first answer wins, within `hedging.budget`.
+
+    Deterministic calls (`temperature=0`) are answered from the on-disk response cache
+    when the same prompt was already sent to one of the routed models, and identical
+    deterministic calls that are in flight at the same time share one upstream request.
+    """
+    m_lst = _route(task, prompt, optimize, max_cost, max_latency)
+    cache, cache_keys = _cache_keys(m_lst, prompt, kw)
+    if cache is not None:
+        response = cache.lookup(cache_keys.values())
+        if response is not None:
+            return response
+    flights, flight_key = _flight_key(m_lst, prompt, hedge, kw)
+    if flight_key is not None:
+        return flights.do(flight_key, lambda: _call_routed(m_lst, prompt, hedge, kw, cache, cache_keys))
+    return _call_routed(m_lst, prompt, hedge, kw, cache, cache_keys)
+
+def _call_routed(m_lst, prompt, hedge, kw, cache, cache_keys):
+    """Try `m_lst` in order (see `_attempts`) and cache the answer."""
+    error = None
+    for m_id, backoff in _attempts(m_lst):
+        time.sleep(backoff)
+        delay = _hedge_delay(m_lst, m_id, hedge)
+        try:
+            if delay is None:
+                answered_id, response = m_id, _tracked_call(m_id, prompt, **kw)
+            else:
+                answered_id, response = _hedged_call(m_id, m_lst[1], delay, prompt, **kw)
+        except Exception as e:
+            if not _is_retryable(e):
+                raise
+            error = error or e
+            continue
+        if cache is not None:
+            cache.put(cache_keys[answered_id], response)
+        return response
+    raise error  # escalate
+
+async def wrap_call_async(task, prompt, *, optimize=None, max_cost=None, max_latency=None, hedge=None, **kw):
+    """Async version of `wrap_call`, for fanning out many requests from one event loop."""
+    m_lst = _route(task, prompt, optimize, max_cost, max_latency)
+    cache, cache_keys = _cache_keys(m_lst, prompt, kw)
+    if cache is not None:
+        response = cache.lookup(cache_keys.values())
+        if response is not None:
+            return response
+    flights, flight_key = _flight_key(m_lst, prompt, hedge, kw)
+    if flight_key is not None:
+        return await flights.do_async(flight_key, lambda: _call_routed_async(m_lst, prompt, hedge, kw, cache, cache_keys))
+    return await _call_routed_async(m_lst, prompt, hedge, kw, cache, cache_keys)
+
+async def _call_routed_async(m_lst, prompt, hedge, kw, cache, cache_keys):
+    error = None
+    for m_id, backoff in _attempts(m_lst):
+        await asyncio.sleep(backoff)
+        delay = _hedge_delay(m_lst, m_id, hedge)
+        try:
+            if delay is None:
+                answered_id, response = m_id, await _tracked_call_async(m_id, prompt, **kw)
+            else:
+                answered_id, response = await _hedged_call_async(m_id, m_lst[1], delay, prompt, **kw)
+        except Exception as e:
+            if not _is_retryable(e):
+                raise
+            error = error or e
+            continue
+        if cache is not None:
+            cache.put(cache_keys[answered_id], response)
+        return response
+    raise error  # escalate
+
+def _tracked_stream(m_id, prompt, **kw):
+    """`_stream` that records the outcome in the model's circuit breaker."""
+    try:
+        yield from _stream(m_id, prompt, **kw)
+    except Exception as e:
+        _record_outcome(m_id, e)
+        raise
+    except BaseException:
+        # closed by the consumer before the end: no verdict, but free a half-open trial slot
+        _circuit_breaker().release_trial(m_id)
+        raise
+    _record_outcome(m_id)
+
+async def _tracked_stream_async(m_id, prompt, **kw):
+    try:
+        async for text in _stream_async(m_id, prompt, **kw):
+            yield text
+    except Exception as e:
+        _record_outcome(m_id, e)
+        raise
+    except BaseException:
+        _circuit_breaker().release_trial(m_id)
+        raise
+    _record_outcome(m_id)
+
+def stream_call(task, prompt, *, optimize=None, max_cost=None, max_latency=None, **kw):
+    """Like `wrap_call`, but yield the text of the answer as it arrives.
+
+    Errors fall back to the next model only until the first chunk was yielded; after that
+    they are raised to the caller, which already consumed part of the answer. Streamed
+    calls are not cached, coalesced or hedged.
+    """
+    error = None
+    m_lst = _route(task, prompt, optimize, max_cost, max_latency)
+    for m_id, backoff in _attempts(m_lst):
+        time.sleep(backoff)
+        started = False
+        try:
+            for text in _tracked_stream(m_id, prompt, **kw):
+                started = True
+                yield text
+            return
+        except Exception as e:
+            if started or not _is_retryable(e):
+                raise
+            error = error or e
+    raise error  # escalate
+
+async def stream_call_async(task, prompt, *, optimize=None, max_cost=None, max_latency=None, **kw):
+    """Async version of `stream_call`: `async for text in stream_call_async(task, prompt)`."""
+    error = None
+    m_lst = _route(task, prompt, optimize, max_cost, max_latency)
+    for m_id, backoff in _attempts(m_lst):
+        await asyncio.sleep(backoff)
+        started = False
+        try:
+            async for text in _tracked_stream_async(m_id, prompt, **kw):
+                started = True
+                yield text
+            return
+        except Exception as e:
+            if started or not _is_retryable(e):
+                raise
+            error = error or e
+    raise error  # escalate
+
+# Provider clients are created once per process and reused, so requests share the SDK's
+# HTTP connection pool instead of paying client and TLS setup on every call.
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {provider: client}
+_clients_lock = threading.Lock()
+
+def _provider(model_id):
+    model = _load_cfg().get("models", {}).get(model_id, {})
+    if "provider" in model:
+        return model["provider"]
     if model_id.startswith("gemini"):
-        import google.generativeai as genai
-        return genai.chat(model=model_id, messages=[prompt], **kw)
+        return "google"
     elif model_id.startswith("claude"):
+        return "anthropic"
+    return "openai"
+
+@lru_cache(maxsize=None)
+def provider_limiter(provider):
+    """The provider's rpm/tpm buckets and adaptive concurrency limit (`providers.<name>`)."""
+    cfg = _load_cfg()
+    limits = (cfg.get("providers") or {}).get(provider) or {}
+    return ProviderLimiter(
+        int(limits.get("max_concurrency", cfg["defaults"].get("max_concurrency", 16))),
+        rpm=limits.get("rpm"),
+        tpm=limits.get("tpm"),
+        min_concurrency=limits.get("min_concurrency", 1),
+    )
+
+def _new_client(provider, is_async):
+    # OpenAI/Anthropic requests time out after `timeout_sec` in the SDK; Google calls and all
+    # async calls are bounded by the router. SDK retries are off because the router retries itself
+    timeout = _load_cfg()["defaults"]["timeout_sec"]
+    if provider == "google":
+        import google.generativeai as genai
+        return genai
+    elif provider == "anthropic":
         import anthropic
-        client = anthropic.Anthropic()
-        return client.messages.create(model=model_id, messages=[{"role": "user", "content": prompt}], **kw)
+        client_cls = anthropic.AsyncAnthropic if is_async else anthropic.Anthropic
+        return client_cls(timeout=timeout, max_retries=0)
     else:  # openai
         import openai
-        return openai.ChatCompletion.create(model=model_id, messages=[{"role": "user", "content": prompt}], **kw)
+        client_cls = openai.AsyncOpenAI if is_async else openai.OpenAI
+        return client_cls(timeout=timeout, max_retries=0)
+
+def _get_client(provider):
+    with _clients_lock:
+        if provider not in _clients:
+            _clients[provider] = _new_client(provider, False)
+        return _clients[provider]
+
+def _get_async_client(provider):
+    # async clients belong to the event loop that created them
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if provider not in clients:
+        clients[provider] = _new_client(provider, True)
+    return clients[provider]
+
+def _is_rate_limited(error):
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ in ("RateLimitError", "ResourceExhausted")
+
+def _rate_limit_delay(error, retry):
+    # honour Retry-After when the provider sends it, else back off exponentially with jitter
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        defaults = _load_cfg()["defaults"]
+        return random.uniform(0, min(defaults.get("backoff_max_sec", 8), defaults.get("backoff_base_sec", 0.5) * 2 ** retry))
+
+def _request_tokens(model_id, prompt, kw):
+    # tpm limits count the prompt and the completion budget
+    output_tokens = kw.get("max_tokens") or _load_cfg()["defaults"].get("expected_output_tokens", 1000)
+    return count_prompt_tokens(prompt, _tokenizer_family(model_id)) + output_tokens
+
+def _record_latency(model_id, latency):
+    output_tokens = _load_cfg()["defaults"].get("expected_output_tokens", 1000)
+    latency_stats.record(model_id, latency, _predicted_latency(model_id, output_tokens))
+
+def _send(client, provider, model_id, prompt, kw):
+    # Unified interface
+    if provider == "google":
+        return client.chat(model=model_id, messages=[prompt], **kw)
+    elif provider == "anthropic":
+        return client.messages.create(model=model_id, messages=[{"role": "user", "content": prompt}], **kw)
+    else:  # openai
+        return client.chat.completions.create(model=model_id, messages=[{"role": "user", "content": prompt}], **kw)
+
+def _call(model_id, prompt, **kw):
+    """Send one request, waiting for the provider's rate limits; rate-limited requests are retried on the same model."""
+    provider = _provider(model_id)
+    client = _get_client(provider)
+    limiter = provider_limiter(provider)
+    tokens = _request_tokens(model_id, prompt, kw)
+    max_rate_limit_retry = _load_cfg()["defaults"].get("max_rate_limit_retry", 3)
+    for retry in range(max_rate_limit_retry + 1):
+        time.sleep(limiter.reserve(tokens))
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            if provider == "google":
+                # the legacy genai chat API takes no timeout: wait on a worker thread instead
+                request = _timeout_executor().submit(_send, client, provider, model_id, prompt, kw)
+                response = request.result(timeout=_load_cfg()["defaults"]["timeout_sec"])
+            else:
+                response = _send(client, provider, model_id, prompt, kw)
+        except Exception as e:
+            limiter.release("rate_limited" if _is_rate_limited(e) else "error")
+            if _is_rate_limited(e) and retry < max_rate_limit_retry:
+                time.sleep(_rate_limit_delay(e, retry))
+                continue
+            raise
+        limiter.release()
+        _record_latency(model_id, time.perf_counter() - start)
+        return response
+
+async def _call_async(model_id, prompt, **kw):
+    provider = _provider(model_id)
+    client = _get_async_client(provider)
+    limiter = provider_limiter(provider)
+    tokens = _request_tokens(model_id, prompt, kw)
+    max_rate_limit_retry = _load_cfg()["defaults"].get("max_rate_limit_retry", 3)
+    for retry in range(max_rate_limit_retry + 1):
+        await asyncio.sleep(limiter.reserve(tokens))
+        await limiter.acquire_async()
+        start = time.perf_counter()
+        try:
+            if provider == "google":
+                # google.generativeai has no async chat API, so it runs on a worker thread
+                request = asyncio.to_thread(_send, client, provider, model_id, prompt, kw)
+            else:
+                request = _send(client, provider, model_id, prompt, kw)
+            response = await asyncio.wait_for(request, _load_cfg()["defaults"]["timeout_sec"])
+        except BaseException as e:  # also CancelledError, so a cancelled hedge frees its slot
+            limiter.release("rate_limited" if _is_rate_limited(e) else "error")
+            if _is_rate_limited(e) and retry < max_rate_limit_retry:
+                await asyncio.sleep(_rate_limit_delay(e, retry))
+                continue
+            raise
+        limiter.release()
+        _record_latency(model_id, time.perf_counter() - start)
+        return response
+
+def _send_stream(client, provider, model_id, prompt, kw):
+    """Yield the text chunks of a streamed request."""
+    if provider == "google":
+        # the legacy genai chat API does not stream: the whole answer is one chunk
+        request = _timeout_executor().submit(_send, client, provider, model_id, prompt, kw)
+        yield request.result(timeout=_load_cfg()["defaults"]["timeout_sec"]).last
+    elif provider == "anthropic":
+        for event in _send(client, provider, model_id, prompt, {**kw, "stream": True}):
+            if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                yield event.delta.text
+    else:  # openai
+        for chunk in _send(client, provider, model_id, prompt, {**kw, "stream": True}):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+async def _send_stream_async(client, provider, model_id, prompt, kw):
+    timeout = _load_cfg()["defaults"]["timeout_sec"]
+    if provider == "google":
+        request = asyncio.to_thread(_send, client, provider, model_id, prompt, kw)
+        yield (await asyncio.wait_for(request, timeout)).last
+        return
+    # the SDK's read timeout bounds the wait for each chunk
+    stream = await asyncio.wait_for(_send(client, provider, model_id, prompt, {**kw, "stream": True}), timeout)
+    async for event in stream:
+        if provider == "anthropic":
+            if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                yield event.delta.text
+        elif event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+
+def _stream(model_id, prompt, **kw):
+    """`_call` for a streamed request; the provider slot is held until the stream ends.
+
+    Rate-limited requests are retried on the same model only before the first chunk.
+    """
+    provider = _provider(model_id)
+    client = _get_client(provider)
+    limiter = provider_limiter(provider)
+    tokens = _request_tokens(model_id, prompt, kw)
+    max_rate_limit_retry = _load_cfg()["defaults"].get("max_rate_limit_retry", 3)
+    for retry in range(max_rate_limit_retry + 1):
+        time.sleep(limiter.reserve(tokens))
+        limiter.acquire()
+        start = time.perf_counter()
+        started = False
+        try:
+            for text in _send_stream(client, provider, model_id, prompt, kw):
+                started = True
+                yield text
+        except BaseException as e:  # also GeneratorExit, when the consumer stops early
+            limiter.release("rate_limited" if _is_rate_limited(e) else "error")
+            if _is_rate_limited(e) and not started and retry < max_rate_limit_retry:
+                time.sleep(_rate_limit_delay(e, retry))
+                continue
+            raise
+        limiter.release()
+        _record_latency(model_id, time.perf_counter() - start)
+        return
+
+async def _stream_async(model_id, prompt, **kw):
+    provider = _provider(model_id)
+    client = _get_async_client(provider)
+    limiter = provider_limiter(provider)
+    tokens = _request_tokens(model_id, prompt, kw)
+    max_rate_limit_retry = _load_cfg()["defaults"].get("max_rate_limit_retry", 3)
+    for retry in range(max_rate_limit_retry + 1):
+        await asyncio.sleep(limiter.reserve(tokens))
+        await limiter.acquire_async()
+        start = time.perf_counter()
+        started = False
+        try:
+            async for text in _send_stream_async(client, provider, model_id, prompt, kw):
+                started = True
+                yield text
+        except BaseException as e:
+            limiter.release("rate_limited" if _is_rate_limited(e) else "error")
+            if _is_rate_limited(e) and not started and retry < max_rate_limit_retry:
+                await asyncio.sleep(_rate_limit_delay(e, retry))
+                continue
+            raise
+        limiter.release()
+        _record_latency(model_id, time.perf_counter() - start)
+        return
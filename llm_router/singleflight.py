@@ -0,0 +1,83 @@
+"""In-flight request coalescing (single-flight) for the router.
+
+When threads or asyncio tasks of one process send the same deterministic request at the
+same time (e.g. the same page of a paper from two batch workers), only the first one, the
+leader, calls the provider. The others wait for the leader's response or error instead of
+sending a duplicate request. Followers get the same response object as the leader.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = 0      # upstream calls made by leaders
+        self.coalesced = 0  # calls answered by a request that was already in flight
+        self._flights = {}  # key -> Future of the leader's call
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Return (flight, is_leader) for `key`."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Future()
+            self.calls += 1
+            return flight, True
+
+    def _finish(self, key, flight, response=None, error=None):
+        with self._lock:
+            self._flights.pop(key, None)
+        if isinstance(error, Exception):
+            flight.set_exception(error)
+        elif error is not None:
+            # the leader was cancelled or interrupted: its followers start over
+            flight.cancel()
+        else:
+            flight.set_result(response)
+
+    def do(self, key, fn):
+        """Return `fn()`, or the result of the identical call already in flight under `key`."""
+        while True:
+            flight, is_leader = self._join(key)
+            if is_leader:
+                break
+            try:
+                return flight.result()
+            except CancelledError:
+                continue
+        try:
+            response = fn()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, response)
+        return response
+
+    async def do_async(self, key, fn):
+        """Async version of `do`; `fn()` returns an awaitable."""
+        while True:
+            flight, is_leader = self._join(key)
+            if is_leader:
+                break
+            try:
+                # shield: a cancelled follower must not cancel the leader's flight
+                return await asyncio.shield(asyncio.wrap_future(flight))
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+        try:
+            response = await fn()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, response)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
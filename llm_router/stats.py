@@ -0,0 +1,83 @@
+"""Latencies observed by the router at runtime, per model.
+
+`config.yaml` only knows a model's nominal `speed_tps`. Each successful call records how
+long it took compared to that estimate; the smoothed ratio corrects later estimates, and
+the recent latencies give percentiles per model (used to decide when to hedge).
+"""
+
+import threading
+from collections import deque
+
+
+class LatencyStats:
+    def __init__(self, alpha=0.2, window=256):
+        self.alpha = alpha  # weight of the newest observation in the moving average
+        self.window = window
+        self._ratio = {}
+        self._recent = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_id, latency, predicted=None):
+        """Record one call; `predicted` is the config-based estimate for the same call."""
+        with self._lock:
+            self._recent.setdefault(model_id, deque(maxlen=self.window)).append(latency)
+            if predicted:
+                ratio = latency / predicted
+                prev = self._ratio.get(model_id)
+                self._ratio[model_id] = ratio if prev is None else (1 - self.alpha) * prev + self.alpha * ratio
+
+    def correction(self, model_id):
+        """Observed latency / predicted latency, 1.0 until the model has been called."""
+        return self._ratio.get(model_id, 1.0)
+
+    def count(self, model_id):
+        return len(self._recent.get(model_id, ()))
+
+    def percentile(self, model_id, q):
+        """The `q`-th percentile (0-100) of the recent latencies, or None without observations."""
+        with self._lock:
+            recent = sorted(self._recent.get(model_id, ()))
+        if not recent:
+            return None
+        idx = min(len(recent) - 1, max(0, round(q / 100 * (len(recent) - 1))))
+        return recent[idx]
+
+    def reset(self):
+        with self._lock:
+            self._ratio.clear()
+            self._recent.clear()
+
+
+class HedgeBudget:
+    """Caps hedged requests at `ratio` of the calls that could be hedged, plus `burst`.
+
+    The cap is cumulative (hedges <= ratio * calls + burst), so the extra cost stays bounded
+    even when a provider slows down for everyone, and a fan-out of many simultaneous calls
+    can still hedge its slow tail.
+    """
+
+    def __init__(self, ratio=0.1, burst=5):
+        self.ratio = ratio
+        self.burst = burst
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0  # hedges that answered before the primary
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def try_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.ratio * self.calls + self.burst:
+                return False
+            self.hedges += 1
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+
+latency_stats = LatencyStats()
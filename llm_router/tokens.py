@@ -0,0 +1,107 @@
+"""Token counting for routing decisions and context-window checks.
+
+Prompts may be plain text, `{"image": ..., "text": ...}` dicts (see `tasks/pdf_to_json.py`),
+chat messages, or lists of OpenAI/Anthropic style content parts. Text is counted with a
+per-family counter and images with the family's image pricing rule, instead of measuring
+the repr of the whole prompt.
+
+Every family uses tiktoken's `o200k_base` unless a counter is registered for it with
+`register_token_counter` (e.g. one backed by a provider's count-tokens endpoint). Without
+tiktoken, the old `len(text) // 4` estimate is used.
+"""
+
+import math
+from functools import lru_cache
+
+DEFAULT_IMAGE_SIZE = (1024, 1024)  # used when an image's size is unknown (e.g. raw bytes or URLs)
+IMAGE_KEYS = {"image", "image_url", "input_image"}
+
+_counters = {}
+
+
+def register_token_counter(family, count_text):
+    """Use `count_text(text) -> int` for every model whose tokenizer family is `family`."""
+    _counters[family] = count_text
+    _count_text.cache_clear()
+
+
+@lru_cache
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except ImportError:
+        return None
+
+
+def _default_count(text):
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=4096)
+def _count_text(family, text):
+    return _counters.get(family, _default_count)(text)
+
+
+def _image_size(image):
+    if isinstance(image, dict):
+        if "width" in image and "height" in image:
+            return image["width"], image["height"]
+        return DEFAULT_IMAGE_SIZE
+    size = getattr(image, "size", None)  # PIL.Image
+    if isinstance(size, tuple) and len(size) == 2:
+        return size
+    return DEFAULT_IMAGE_SIZE
+
+
+def image_tokens(image, family="openai"):
+    """Approximate input tokens of one image, following each provider's documented rule."""
+    if family == "google":
+        return 258
+    width, height = _image_size(image)
+    if family == "anthropic":
+        # images are downscaled to fit 1568px on the long edge, then cost width*height/750
+        scale = min(1.0, 1568 / max(width, height))
+        return math.ceil(width * scale * height * scale / 750)
+
+    # openai: 85 base tokens, plus 170 per 512px tile after fitting in 2048x2048 and
+    # scaling the short side down to 768px; "low" detail is the base cost only
+    if isinstance(image, dict):
+        image_url = image.get("image_url")
+        if "low" in (image.get("detail"), image_url.get("detail") if isinstance(image_url, dict) else None):
+            return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _count_part(part, family):
+    if part is None:
+        return 0
+    if isinstance(part, str):
+        return _count_text(family, part)
+    if isinstance(part, dict):
+        if part.get("type") in IMAGE_KEYS:
+            return image_tokens(part, family)
+        return sum(
+            image_tokens(value, family) if key in IMAGE_KEYS else _count_part(value, family)
+            for key, value in part.items() if key != "type"
+        )
+    if isinstance(part, (list, tuple)):
+        return sum(_count_part(item, family) for item in part)
+    if isinstance(part, (bytes, bytearray)) or hasattr(part, "mode"):  # raw image or PIL.Image
+        return image_tokens(part, family)
+    return _count_text(family, str(part))
+
+
+def count_prompt_tokens(prompt, family="openai"):
+    """Return the input tokens of a prompt for a tokenizer family."""
+    if isinstance(prompt, list) and prompt and all(isinstance(msg, dict) and "role" in msg for msg in prompt):
+        # chat messages: 3 tokens per message and 3 to prime the reply (as in `num_tokens_from_messages`)
+        return sum(3 + _count_part(msg.get("content"), family) for msg in prompt) + 3
+    return _count_part(prompt, family)
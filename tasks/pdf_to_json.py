@@ -1,16 +1,63 @@
-from llm_router.router import wrap_call
+import asyncio
 
+from codes.extraction_cache import DEFAULT_CACHE_DIR, ExtractionCache, file_sha256
+from llm_router.router import wrap_call, wrap_call_async
 
-def pdf_to_json(path):
+EXTRACTOR = "tasks_pdf_to_json"
+EXTRACTOR_VERSION = "1"
+PAGE_PROMPT = "Extract structured JSON"
+
+
+def page_keys(path, n_pages, cache):
+    # pages of the same PDF content reuse their answer, whatever the file is called
+    pdf_hash = file_sha256(path)
+    options = {"task": "rag", "prompt": PAGE_PROMPT, "temperature": 0}
+    return [cache.key(pdf_hash, EXTRACTOR, EXTRACTOR_VERSION, options, page_num) for page_num in range(1, n_pages + 1)]
+
+
+def pdf_to_json(path, cache_dir=DEFAULT_CACHE_DIR):
     imgs = pdf_to_images(path)
+    cache = ExtractionCache(cache_dir) if cache_dir else None
+    keys = page_keys(path, len(imgs), cache) if cache is not None else [None] * len(imgs)
     out = []
-    for img in imgs:
-        j = wrap_call(
+    for img, key in zip(imgs, keys):
+        j = cache.get(key) if cache is not None else None
+        if j is None:
+            j = wrap_call(
+                task="rag",
+                prompt={"image": img, "text": PAGE_PROMPT},
+                temperature=0,
+            )
+            if cache is not None:
+                cache.put(key, j)
+        out.append(j)
+    return merge_pages(out)
+
+
+async def pdf_to_json_async(path, cache_dir=DEFAULT_CACHE_DIR):
+    imgs = pdf_to_images(path)
+    cache = ExtractionCache(cache_dir) if cache_dir else None
+    keys = page_keys(path, len(imgs), cache) if cache is not None else [None] * len(imgs)
+    out = [cache.get(key) if cache is not None else None for key in keys]
+    missing = [idx for idx, j in enumerate(out) if j is None]
+
+    async def call_page(idx):
+        j = await wrap_call_async(
             task="rag",
-            prompt={"image": img, "text": "Extract structured JSON"},
+            prompt={"image": imgs[idx], "text": PAGE_PROMPT},
             temperature=0,
         )
-        out.append(j)
+        # cached as soon as it arrives, so a failed page does not cost the others
+        if cache is not None:
+            cache.put(keys[idx], j)
+        return j
+
+    # pages are independent; the router bounds how many are in flight per provider
+    results = await asyncio.gather(*[call_page(idx) for idx in missing], return_exceptions=True)
+    for idx, j in zip(missing, results):
+        if isinstance(j, BaseException):
+            raise j
+        out[idx] = j
     return merge_pages(out)
 
 
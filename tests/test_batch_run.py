@@ -0,0 +1,68 @@
+import json
+import os
+import sys
+
+# Ensure `codes` and its flat imports (`from utils import ...`) are importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "codes"))
+
+import codes.batch_run as batch_run
+
+
+def test_load_manifest_dataset_info():
+    manifest_path = os.path.join(ROOT, "data", "paper2code", "dataset_info.json")
+    paper_lst = batch_run.load_manifest(manifest_path, "data", "JSON")
+    assert len(paper_lst) == 90
+    assert {paper["group"] for paper in paper_lst} == {"iclr2024", "icml2024", "nips2024"}
+    first = paper_lst[0]
+    # absolute, since pipeline.py runs with cwd=CODES_DIR
+    assert first["paper_path"] == os.path.join(os.path.abspath("data"), first["group"], f"{first['paper_name']}_cleaned.json")
+
+    iclr_lst = batch_run.load_manifest(manifest_path, "data", "JSON", conferences=["iclr2024"])
+    assert len(iclr_lst) == 30
+
+
+def test_run_paper_isolates_failures(tmp_path, monkeypatch):
+    codes_dir = tmp_path / "codes"
+    codes_dir.mkdir()
+    # fake pipeline: fails for paper "bad", logs one call for the others
+    (codes_dir / "pipeline.py").write_text(
+        "import json, sys\n"
+        "args = dict(zip(sys.argv[1::2], sys.argv[2::2]))\n"
+        "if args['--paper_name'] == 'bad':\n"
+        "    sys.exit(1)\n"
+        "out = args['--output_dir']\n"
+        "usage = {'stage': 'x', 'actual_input_tokens': 90, 'cached_tokens': 10, 'output_tokens': 5, 'total_cost': 0.5}\n"
+        "open(out + '/usage_log.jsonl', 'a').write(json.dumps(usage) + '\\n')\n"
+        "json.dump({'total_cost': 0.5}, open(out + '/accumulated_cost.json', 'w'))\n"
+    )
+    monkeypatch.setattr(batch_run, "CODES_DIR", str(codes_dir))
+    paper_path = tmp_path / "paper.json"
+    paper_path.write_text("{}")
+
+    good = batch_run.run_paper({"paper_name": "good", "paper_path": str(paper_path), "group": "g"}, str(tmp_path / "out"), "JSON", [])
+    bad = batch_run.run_paper({"paper_name": "bad", "paper_path": str(paper_path), "group": "g"}, str(tmp_path / "out"), "JSON", [])
+    missing = batch_run.run_paper({"paper_name": "missing", "paper_path": str(tmp_path / "nope.json"), "group": "g"}, str(tmp_path / "out"), "JSON", [])
+
+    assert good["status"] == "ok"
+    assert good["input_tokens"] == 100 and good["output_tokens"] == 5 and good["total_cost"] == 0.5
+    assert good["output_dir"] == os.path.join(str(tmp_path / "out"), "g", "good")
+    assert bad["status"] == "failed"
+    assert missing["status"] == "missing"
+
+
+def test_vllm_backend_runs_one_paper_at_a_time(tmp_path, monkeypatch):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps([{"paper_name": "p", "paper_path": "p.json"}]))
+    monkeypatch.setattr(batch_run, "run_paper", lambda paper, *_: {
+        "paper_name": paper["paper_name"], "group": "", "status": "missing", "wall_time_sec": 0.0, "backend": "vllm",
+        "calls": None, "input_tokens": None, "cached_tokens": None, "output_tokens": None, "total_cost": None})
+    args = batch_run.argparse.Namespace(manifest=str(manifest_path), data_dir="data", paper_format="JSON",
+                                        output_root=str(tmp_path / "out"), max_papers=4, conferences=None, limit=0)
+    batch_run.main(args, ["--backend", "vllm"])
+
+    assert args.max_papers == 1
+    assert batch_run.get_backend(["--backend=vllm"]) == "vllm" and batch_run.get_backend([]) == "openai"
+    with open(tmp_path / "out" / "batch_summary.json") as f:
+        assert json.load(f)["papers"][0]["total_cost"] is None
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from codes.extraction_cache import ExtractionCache, file_sha256
+
+
+def test_keys_follow_content_and_options(tmp_path):
+    a, b = tmp_path / "a.pdf", tmp_path / "renamed.pdf"
+    a.write_bytes(b"%PDF same content")
+    b.write_bytes(b"%PDF same content")
+    assert file_sha256(a) == file_sha256(b)
+
+    cache = ExtractionCache(str(tmp_path / "cache"))
+    key = cache.key(file_sha256(a), "simple", "1", {"ocr_dpi": 300}, 2)
+    assert key == cache.key(file_sha256(b), "simple", "1", {"ocr_dpi": 300}, 2)
+    assert len({key, cache.key(file_sha256(a), "simple", "2", {"ocr_dpi": 300}, 2),
+                cache.key(file_sha256(a), "simple", "1", {"ocr_dpi": 200}, 2),
+                cache.key(file_sha256(a), "simple", "1", {"ocr_dpi": 300}, 3),
+                cache.key(file_sha256(a), "hybrid", "1", {"ocr_dpi": 300}, 2)}) == 5
+
+    assert cache.get(key) is None
+    cache.put(key, {"text": "page 2"})
+    assert ExtractionCache(str(tmp_path / "cache")).get(key) == {"text": "page 2"}
+    assert cache.stats()["extractors"] == {"simple": {"entries": 1, "bytes": cache.stats()["bytes"]}}
+
+
+def test_eviction_and_prune_drop_least_recently_used(tmp_path):
+    cache = ExtractionCache(str(tmp_path), max_size_mb=0.01)  # ~10 KB
+    keys = [cache.key("pdf", "simple", "1", page=page_num) for page_num in range(1, 5)]
+    for age, key in enumerate(keys):
+        cache.put(key, "x" * 3000)
+        os.utime(cache._path(key), (time.time() - 100 + age, time.time() - 100 + age))
+    # the 4th entry pushed the cache above 10 KB, so the oldest one went
+    assert cache.get(keys[0]) is None
+    assert all(cache.get(key) is not None for key in keys[1:])
+
+    os.utime(cache._path(keys[1]), (time.time() - 5 * 86400,) * 2)
+    assert cache.prune(older_than_days=1) == 1
+    assert cache.stats()["entries"] == 2
+    assert cache.prune(max_size_mb=0) == 2
+    assert cache.stats()["entries"] == 0
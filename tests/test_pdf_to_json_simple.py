@@ -28,6 +28,13 @@ if hasattr(sys.modules["pytesseract"], "image_to_string") is False:
 
 import codes.pdf_to_json_simple as pdf_simple
 
+class ListDoc(list):
+    """A fitz document stand-in: iterates over its pages and can be closed."""
+    closed = False
+    def close(self):
+        self.closed = True
+
+
 # restore modules after import
 def teardown_module(module):
     for name, obj in modules_to_mock.items():
@@ -85,11 +92,9 @@ def test_extract_pages(monkeypatch):
             self.parent = SimpleNamespace(name="c.pdf")
         def get_text(self):
             return f"text{self.number}"
-    class DummyDoc:
-        def __iter__(self):
-            return iter([DummyPage(0), DummyPage(1)])
-    monkeypatch.setattr(pdf_simple, "fitz", SimpleNamespace(open=lambda x: DummyDoc()))
-    monkeypatch.setattr(pdf_simple, "extract_tables", lambda path, page_number: [page_number])
+    monkeypatch.setattr(pdf_simple, "fitz", SimpleNamespace(open=lambda x: ListDoc([DummyPage(0), DummyPage(1)])))
+    monkeypatch.setattr(pdf_simple, "is_table_candidate", lambda page: True)
+    monkeypatch.setattr(pdf_simple, "extract_all_tables", lambda path, page_numbers: {n: [n] for n in page_numbers})
     pages = pdf_simple.extract_pages("c.pdf")
     assert pages == [
         {"page_number": 1, "text": "text0", "tables": [1]},
@@ -97,10 +102,137 @@ def test_extract_pages(monkeypatch):
     ]
 
 
+def test_extract_pages_with_workers_keeps_page_order(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    class DummyPage:
+        def __init__(self, num):
+            self.number = num
+            self.parent = SimpleNamespace(name="d.pdf")
+        def get_text(self):
+            return f"text{self.number}"
+    class DummyDoc:
+        page_count = 10
+        def pages(self, start, stop):
+            opened.append((start, stop))
+            return iter([DummyPage(i) for i in range(start, stop)])
+        def close(self):
+            pass
+    opened = []
+    monkeypatch.setattr(pdf_simple, "fitz", SimpleNamespace(open=lambda x: DummyDoc()))
+    monkeypatch.setattr(pdf_simple, "is_table_candidate", lambda page: False)
+    # threads stand in for the process pool, which can't see the patched fitz
+    monkeypatch.setattr(pdf_simple, "ProcessPoolExecutor", ThreadPoolExecutor)
+    pages = pdf_simple.extract_pages("d.pdf", workers=2)
+    assert [page["page_number"] for page in pages] == list(range(1, 11))
+    assert [page["text"] for page in pages] == [f"text{i}" for i in range(10)]
+    assert sorted(opened) == [(0, 2), (2, 4), (4, 6), (6, 8), (8, 10)]
+
+
+def test_extract_pages_ocrs_text_less_pages_in_one_batch(monkeypatch):
+    class DummyPage:
+        def __init__(self, num):
+            self.number = num
+        def get_text(self):
+            return "" if self.number % 2 else f"text{self.number}"
+    rendered = []
+
+    def fake_render(page, dpi=300):
+        rendered.append(page.number)
+        return f"img{page.number}"
+
+    monkeypatch.setattr(pdf_simple, "fitz", SimpleNamespace(open=lambda x: ListDoc(DummyPage(i) for i in range(5))))
+    monkeypatch.setattr(pdf_simple, "is_table_candidate", lambda page: False)
+    monkeypatch.setattr(pdf_simple, "render_page", fake_render)
+    monkeypatch.setattr(pdf_simple, "convert_from_path", lambda *a, **k: pytest.fail("poppler called per page"))
+    monkeypatch.setattr(pdf_simple, "pytesseract", SimpleNamespace(image_to_string=lambda img: f"ocr:{img}"))
+    pages = pdf_simple.extract_pages("e.pdf", ocr_workers=2)
+    assert [page["text"] for page in pages] == ["text0", "ocr:img1", "text2", "ocr:img3", "text4"]
+    assert rendered == [1, 3]
+
+
+def test_tables_are_read_in_one_pass_over_prescreened_pages(monkeypatch):
+    P = lambda x, y: SimpleNamespace(x=x, y=y)
+    grid = [{"items": [("l", P(0, y), P(100, y)) for y in (0, 10, 20)] + [("l", P(x, 0), P(x, 20)) for x in (0, 100)]}]
+    booktabs = [{"items": [("l", P(0, y), P(100, y)) for y in (0, 10, 20)]}]
+    figure = [{"items": [("l", P(0, 0), P(30, 40)), ("c", P(0, 0), P(1, 1), P(2, 2), P(3, 3))]}]
+    assert pdf_simple.is_table_candidate(SimpleNamespace(get_drawings=lambda: grid))
+    assert not pdf_simple.is_table_candidate(SimpleNamespace(get_drawings=lambda: booktabs))
+    assert not pdf_simple.is_table_candidate(SimpleNamespace(get_drawings=lambda: figure))
+
+    class DummyTable:
+        def __init__(self, page, value):
+            self.page = page
+            self.df = SimpleNamespace(to_dict=lambda: {"table": value})
+    calls = []
+    class DummyCamelot:
+        def read_pdf(self, pdf_path, pages):
+            calls.append(pages)
+            return [DummyTable("3", 1), DummyTable("9", 2), DummyTable("9", 3)]
+    monkeypatch.setattr(pdf_simple, "camelot", DummyCamelot())
+    assert pdf_simple.extract_all_tables("file.pdf", [3, 9]) == {3: [{"table": 1}], 9: [{"table": 2}, {"table": 3}]}
+    assert calls == ["3,9"]
+    assert pdf_simple.extract_all_tables("file.pdf", []) == {}
+    assert calls == ["3,9"]
+
+
+def test_extract_pages_reuses_cached_pages(tmp_path, monkeypatch):
+    class DummyPage:
+        def __init__(self, num):
+            self.number = num
+        def get_text(self):
+            extracted.append(self.number)
+            return f"text{self.number}"
+    extracted = []
+    pdf = tmp_path / "f.pdf"
+    pdf.write_bytes(b"%PDF")
+    monkeypatch.setattr(pdf_simple, "is_table_candidate", lambda page: False)
+    docs = []
+
+    def fake_open(path, n_pages):
+        docs.append(ListDoc(DummyPage(i) for i in range(n_pages)))
+        return docs[-1]
+    created = []
+
+    class CountingCache(pdf_simple.ExtractionCache):
+        def __init__(self, *args, **kwargs):
+            created.append(self)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(pdf_simple, "ExtractionCache", CountingCache)
+    monkeypatch.setattr(pdf_simple, "_cache_dict", {})
+    monkeypatch.setattr(pdf_simple, "fitz", SimpleNamespace(open=lambda x: fake_open(x, 2)))
+    first = pdf_simple.extract_pages(str(pdf), cache_dir=str(tmp_path / "cache"))
+    monkeypatch.setattr(pdf_simple, "fitz", SimpleNamespace(open=lambda x: fake_open(x, 3)))
+    second = pdf_simple.extract_pages(str(pdf), cache_dir=str(tmp_path / "cache"))
+    assert second[:2] == first
+    assert extracted == [0, 1, 2]  # only the new page is extracted again
+    assert len(created) == 1  # one cache per process, not per run or page range
+    assert all(doc.closed for doc in docs)
+
+
 def test_build_json(tmp_path, monkeypatch):
     sample_pages = [{"page_number": 1, "text": "a", "tables": []}]
-    monkeypatch.setattr(pdf_simple, "extract_pages", lambda path: sample_pages)
+    monkeypatch.setattr(pdf_simple, "extract_pages", lambda path, workers=1, ocr_workers=0, cache_dir=None: sample_pages)
     out_json = tmp_path / "out.json"
     pdf_simple.build_json("x.pdf", out_json)
     data = json.loads(out_json.read_text())
     assert data == {"pages": sample_pages}
+
+
+def test_build_jsonl_streams_pages_and_reads_ranges_lazily(tmp_path, monkeypatch):
+    out_jsonl = tmp_path / "out.jsonl"
+
+    def fake_iter_pages(path, workers=1, ocr_workers=0, cache_dir=None):
+        for page_num in range(1, 6):
+            if page_num > 1:  # earlier pages are on disk before the next one is extracted
+                assert len(out_jsonl.read_text().splitlines()) == page_num - 1
+            yield {"page_number": page_num, "text": f"text{page_num}", "tables": []}
+
+    monkeypatch.setattr(pdf_simple, "iter_pages", fake_iter_pages)
+    pdf_simple.build_jsonl("x.pdf", str(out_jsonl))
+
+    import codes.utils as utils
+    assert [page["page_number"] for page in utils.read_pages_jsonl(str(out_jsonl), 2, 3)] == [2, 3]
+    with open(out_jsonl, "a") as f:
+        f.write('{"page_number": 6, "te')  # interrupted while writing page 6
+    assert [page["page_number"] for page in utils.read_pages_jsonl(str(out_jsonl), 4)] == [4, 5]
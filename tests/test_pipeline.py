@@ -0,0 +1,46 @@
+import os
+import sys
+from types import SimpleNamespace
+
+# Ensure the repository root is on sys.path so that `codes` is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import codes.pipeline as pipeline
+
+
+def test_run_pipeline_runs_stages_in_one_process(tmp_path, monkeypatch):
+    codes_dir = tmp_path / "codes"
+    codes_dir.mkdir()
+    log_path = tmp_path / "calls.log"
+    stage_script = (
+        "import sys\n"
+        f"with open({str(log_path)!r}, 'a') as f:\n"
+        "    f.write(' '.join([sys.argv[0].split('/')[-1]] + sys.argv[1:]) + '\\n')\n"
+    )
+    for name in ["1_planning.py", "2_analyzing.py", "3_coding.py"]:
+        (codes_dir / name).write_text(stage_script)
+    output_dir = tmp_path / "out"
+    (codes_dir / "1.1_extract_config.py").write_text(
+        stage_script + f"open({str(output_dir / 'planning_config.yaml')!r}, 'w').write('lr: 1')\n"
+    )
+    monkeypatch.setattr(pipeline, "CODES_DIR", str(codes_dir))
+
+    args = SimpleNamespace(
+        paper_name="Transformer", backend="openai", gpt_version="o3-mini",
+        paper_format="JSON", pdf_json_path="paper.json", pdf_latex_path=None,
+        output_dir=str(output_dir), output_repo_dir=str(tmp_path / "repo"),
+        max_concurrency=4, code_context="relevant", batch_generation=False, wave_generation=False,
+        stream=True,
+    )
+    argv = list(sys.argv)
+    pipeline.run_pipeline(args)
+
+    calls = log_path.read_text().splitlines()
+    assert [call.split()[0] for call in calls] == ["1_planning.py", "1.1_extract_config.py", "2_analyzing.py", "3_coding.py"]
+    assert "--gpt_version o3-mini" in calls[0]
+    assert "--max_concurrency 4" in calls[2]
+    assert "--code_context relevant" in calls[3]
+    assert "--stream" in calls[0] and "--stream" in calls[3]
+    assert (tmp_path / "repo" / "config.yaml").read_text() == "lr: 1"
+    assert sys.argv == argv
@@ -0,0 +1,442 @@
+import asyncio
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+# Ensure the repository root is on sys.path so that `llm_router` is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import llm_router.router as router
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    """Point the router at a copy of the repo config and reset its per-process state."""
+    def write(text=None, keep=()):
+        if text is None:
+            with open(os.path.join(ROOT, "llm_router", "config.yaml")) as f:
+                text = f.read()
+        path = tmp_path / "config.yaml"
+        text = text.replace("~/.cache/paper2code/llm_router", str(tmp_path / "cache"))
+        if "rpm" not in keep:  # rate limits only where a test exercises them
+            text = re.sub(r"\n +[rt]pm: .*", "", text)
+        path.write_text(text)
+        monkeypatch.setattr(router, "CONFIG_PATH", str(path))
+        router.reload_config()
+        router._clients.clear()
+        router.latency_stats.reset()
+        return path
+
+    write()
+    yield write
+    router.reload_config()
+    router._clients.clear()
+
+
+class FakeCompletions:
+    def __init__(self, state, is_async, events=False):
+        self.state = state
+        self.is_async = is_async
+        self.events = events  # stream Anthropic-style events instead of OpenAI chunks
+
+    def _chunks(self, response):
+        pieces = ["streamed ", response["model"]]
+        if self.events:
+            return [SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(text=p)) for p in pieces]
+        return [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))]) for p in pieces]
+
+    def _record(self, model):
+        self.state["calls"].append(model)
+        failure = self.state["fail"].get(model)
+        if isinstance(failure, list):  # fail only the next len(failure) calls
+            failure = failure.pop(0) if failure else None
+        if failure is not None:
+            raise failure
+        return {"model": model}
+
+    def create(self, model, messages, **kw):
+        if not self.is_async:
+            time.sleep(self.state["latency"](model) if "latency" in self.state else 0)
+            response = self._record(model)
+            return iter(self._chunks(response)) if kw.get("stream") else response
+
+        async def run():
+            self.state["in_flight"] += 1
+            self.state["peak"] = max(self.state["peak"], self.state["in_flight"])
+            await asyncio.sleep(self.state["latency"](model) if "latency" in self.state else 0.001)
+            self.state["in_flight"] -= 1
+            response = self._record(model)
+            if not kw.get("stream"):
+                return response
+
+            async def chunks():
+                for chunk in self._chunks(response):
+                    yield chunk
+            return chunks()
+        return run()
+
+
+def fake_client_factory(state):
+    def new_client(provider, is_async):
+        state["created"].append((provider, is_async))
+        if provider == "google":  # genai.chat(model=..., messages=...), sync only
+            return SimpleNamespace(chat=FakeCompletions(state, False).create)
+        return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(state, is_async)),
+                               messages=FakeCompletions(state, is_async, events=True))
+    return new_client
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    state = {"created": [], "calls": [], "fail": {}, "in_flight": 0, "peak": 0}
+    monkeypatch.setattr(router, "_new_client", fake_client_factory(state))
+    return state
+
+
+def test_wrap_call_reuses_provider_client(cfg, fake):
+    for _ in range(3):
+        assert router.wrap_call("tool_reasoning", "plan a call") == {"model": "o4mini"}
+    assert fake["created"] == [("openai", False)]
+
+
+def test_wrap_call_async_bounds_in_flight_requests(cfg, fake):
+    cfg(open(router.CONFIG_PATH).read().replace("max_concurrency: 32", "max_concurrency: 4"))
+
+    async def fan_out():
+        return await asyncio.gather(*[router.wrap_call_async("tool_reasoning", f"page {i}") for i in range(50)])
+
+    results = asyncio.run(fan_out())
+    assert results == [{"model": "o4mini"}] * 50
+    assert fake["created"] == [("openai", True)]
+    assert 1 < fake["peak"] <= 4
+
+
+def test_choose_model_matches_alternatives_and_token_bands(cfg):
+    assert router.choose_model("rag") == "gemini_flash_25"
+    assert router.choose_model("unit_tests") == "claude_sonnet_37"
+    assert router.choose_model("long_doc", tokens=300_001) == "gpt41"
+    with pytest.raises(ValueError):
+        router.choose_model("long_doc", tokens=300_000)
+    with pytest.raises(ValueError):
+        router.choose_model("ra")  # alternatives match exactly, not as substrings
+
+    cfg(open(router.CONFIG_PATH).read().replace("  tool_reasoning:", "  long_doc:\n    primary: o4mini\n    fallback: gpt41\n  tool_reasoning:"))
+    assert router.choose_model("long_doc", tokens=1_000) == "o4mini"
+    assert router.choose_model("long_doc", tokens=500_000) == "gpt41"
+
+
+def test_token_counts_drive_routing_and_context_checks(cfg, fake, monkeypatch):
+    from llm_router import tokens
+    monkeypatch.setattr(tokens, "_counters", {})
+    tokens.register_token_counter("openai", lambda text: len(text.split()))
+    tokens.register_token_counter("google", lambda text: len(text.split()))
+
+    class Image:  # stands in for PIL.Image
+        mode = "RGB"
+        size = (1700, 2200)
+        def __repr__(self):
+            return "x " * 1_000_000
+
+    prompt = {"image": Image(), "text": "Extract structured JSON"}
+    assert tokens.count_prompt_tokens(prompt) == 3 + 85 + 170 * 2 * 2
+    assert tokens.count_prompt_tokens(prompt, "google") == 3 + 258
+    assert tokens.count_prompt_tokens([{"role": "user", "content": "one two"}]) == 3 + 2 + 3
+
+    # 250k words route to long_doc>300k only once they are counted as more than 300k tokens
+    with pytest.raises(ValueError):
+        router.wrap_call("long_doc", "word " * 250_000)
+    assert router.wrap_call("long_doc", "word " * 300_001) == {"model": "gpt41"}
+
+    # o4mini (200k context) is skipped in favour of its 1M-context fallback
+    assert router.wrap_call("tool_reasoning", "word " * 250_000) == {"model": "gemini_flash_25"}
+    tokens.register_token_counter("google", lambda text: 2 * len(text.split()))
+    with pytest.raises(ValueError):
+        router.wrap_call("tool_reasoning", "word " * 600_000)
+    tokens._count_text.cache_clear()
+
+
+def test_optimized_selection_uses_prices_speeds_and_observed_latency(cfg):
+    assert router.choose_model("code", tokens=10_000) == "claude_sonnet_37"
+    assert router.choose_model("code", tokens=10_000, optimize="cost") == "o4mini"
+    assert router.choose_model("code", tokens=10_000, optimize="latency") == "o4mini"
+    assert router.rank_models("code", tokens=300_000, optimize="cost") == ["gpt41"]  # context
+    with pytest.raises(ValueError):
+        router.choose_model("code", tokens=10_000, optimize="cost", max_cost=0.01)
+
+    # rag: gemini is cheapest and nominally fastest (1000 / 380 tps ~ 2.6s)
+    assert router.choose_model("rag", tokens=1_000, optimize="latency") == "gemini_flash_25"
+    for _ in range(5):
+        router.latency_stats.record("gemini_flash_25", 30.0, router._predicted_latency("gemini_flash_25", 1000))
+    assert router.choose_model("rag", tokens=1_000, optimize="latency") == "o4mini"
+    assert router.choose_model("rag", tokens=1_000, optimize="latency", max_latency=10) == "o4mini"
+    assert router.choose_model("rag", tokens=1_000, optimize="cost") == "gemini_flash_25"
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_wrap_call_fallback_chain_backoff_and_circuit_breaker(cfg, fake, monkeypatch):
+    cfg(open(router.CONFIG_PATH).read().replace("fallback: gemini_flash_25", "fallback: [gemini_flash_25, claude_sonnet_35]"))
+    sleeps = []
+    monkeypatch.setattr(router.time, "sleep", sleeps.append)
+
+    fake["fail"] = {"o4mini": StatusError(503), "gemini_flash_25": TimeoutError()}
+    assert router.wrap_call("tool_reasoning", "hi") == {"model": "claude_sonnet_35"}
+    assert fake["calls"] == ["o4mini", "gemini_flash_25", "claude_sonnet_35"]
+    assert all(backoff == 0 for backoff in sleeps)  # switching models does not wait
+
+    # every model fails: the budget is primary + max_retry, and repeat attempts back off
+    fake["calls"].clear()
+    fake["fail"]["claude_sonnet_35"] = StatusError(500)
+    with pytest.raises(StatusError):
+        router.wrap_call("tool_reasoning", "hi")
+    assert fake["calls"] == ["o4mini", "gemini_flash_25", "claude_sonnet_35", "gemini_flash_25"]
+    assert 0 <= sleeps[-1] <= 0.5
+
+    # after 5 consecutive failures the primary is skipped without a call
+    for _ in range(3):
+        with pytest.raises(StatusError):
+            router.wrap_call("tool_reasoning", "hi")
+    assert router._circuit_breaker().state("o4mini") == "open"
+    fake["calls"].clear()
+    del fake["fail"]["claude_sonnet_35"]
+    assert router.wrap_call("tool_reasoning", "hi") == {"model": "claude_sonnet_35"}
+    assert "o4mini" not in fake["calls"]
+
+    # client errors are not retried on other models
+    fake["calls"].clear()
+    fake["fail"] = {"claude_sonnet_37": StatusError(400)}
+    with pytest.raises(StatusError):
+        router.wrap_call("code", "hi")
+    assert fake["calls"] == ["claude_sonnet_37"]
+
+
+def test_circuit_breaker_half_open_trial():
+    now = [0.0]
+    breaker = router.CircuitBreaker(failure_threshold=2, cooldown_sec=10, clock=lambda: now[0])
+    breaker.record_failure("m")
+    assert breaker.allow("m")
+    breaker.record_failure("m")
+    assert not breaker.allow("m")
+    now[0] = 11
+    assert breaker.allow("m") and not breaker.allow("m")  # one trial call
+    breaker.record_failure("m")
+    assert breaker.state("m") == "open"
+    now[0] = 22
+    assert breaker.allow("m")
+    breaker.record_success("m")
+    assert breaker.state("m") == "closed"
+
+
+def test_hedging_cuts_p99_latency_with_mock_provider(cfg, fake):
+    # claude_sonnet_37 answers in 20ms, except every 25th call which takes 400ms; o4mini always takes 20ms
+    cfg(open(router.CONFIG_PATH).read().replace("budget: 0.1", "budget: 0.2"))
+    n_calls = {"claude_sonnet_37": 0}
+    def latency(model):
+        if model != "claude_sonnet_37":
+            return 0.02
+        n_calls[model] += 1
+        return 0.4 if n_calls[model] % 25 == 0 else 0.02
+    fake["latency"] = latency
+
+    async def timed_call(semaphore, hedge):
+        async with semaphore:  # 10 callers at a time
+            start = time.perf_counter()
+            await router.wrap_call_async("code", "hi", hedge=hedge)
+            return time.perf_counter() - start
+
+    def p99(hedge):
+        async def run():
+            semaphore = asyncio.Semaphore(10)
+            return await asyncio.gather(*[timed_call(semaphore, hedge) for _ in range(200)])
+        return sorted(asyncio.run(run()))[int(0.99 * 200) - 1]
+
+    unhedged = p99(hedge=False)
+    hedged = p99(hedge=True)  # the primary's p95 is ~20ms, so slow calls are hedged early
+    assert unhedged >= 0.4
+    assert hedged < unhedged / 2
+    budget = router.hedge_budget()
+    assert budget.hedges <= 0.2 * budget.calls + budget.burst
+    assert budget.hedge_wins >= 8
+
+
+def test_deterministic_calls_are_cached_on_disk_with_lru_eviction(cfg, fake):
+    class Image:  # stands in for PIL.Image
+        mode, size = "L", (2, 2)
+        def __init__(self, pixels):
+            self.pixels = pixels
+        def tobytes(self):
+            return self.pixels
+
+    for _ in range(2):
+        router.wrap_call("tool_reasoning", {"image": Image(b"abcd"), "text": "Extract  "}, temperature=0)
+    router.wrap_call("tool_reasoning", {"image": Image(b"abce"), "text": "Extract"}, temperature=0)
+    router.wrap_call("tool_reasoning", "not cached", temperature=0.7)
+    assert fake["calls"] == ["o4mini", "o4mini", "o4mini"]
+    assert router.response_cache().stats()["hits"] == 1
+    assert router.response_cache().stats()["misses"] == 2
+    assert router.response_cache().stats()["entries"] == 2
+
+    # a new process (fresh cache object) still hits the files on disk
+    router.reload_config()
+    assert router.wrap_call("tool_reasoning", {"image": Image(b"abcd"), "text": "Extract"}, temperature=0) == {"model": "o4mini"}
+    assert len(fake["calls"]) == 3
+
+    cache = router.ResponseCache(router.response_cache().cache_dir, max_bytes=3 * 100)
+    for i in range(10):
+        cache.put(f"{i:064x}", "x" * 40)
+    assert cache.stats()["bytes"] <= 3 * 100
+    assert cache.lookup([f"{9:064x}"]) == "x" * 40
+    assert cache.lookup([f"{0:064x}"]) is None
+
+
+def test_token_buckets_and_aimd_concurrency():
+    now = [0.0]
+    clock = lambda: now[0]
+
+    # 60 rpm: 1 request/s with a 10s burst
+    limiter = router.ProviderLimiter(8, rpm=60, tpm=6000, clock=clock)
+    assert [limiter.reserve(0) for _ in range(10)] == [0.0] * 10
+    assert limiter.reserve(0) == pytest.approx(1.0)
+    # 6000 tpm: 100 tokens/s with a 1000 token burst; the 10 requests above used none
+    limiter = router.ProviderLimiter(8, tpm=6000, clock=clock)
+    assert limiter.reserve(1000) == 0.0
+    assert limiter.reserve(500) == pytest.approx(5.0)
+    now[0] = 5.0
+    assert limiter.reserve(0) == 0.0
+
+    limiter = router.ProviderLimiter(8, clock=clock, cooldown_sec=1.0)
+    for _ in range(3):
+        limiter.acquire()
+    limiter.release("rate_limited")
+    limiter.release("rate_limited")  # same burst: halved only once
+    assert limiter.limit == 4
+    now[0] = 7.0
+    limiter.release("rate_limited")
+    assert limiter.limit == 2
+    limiter.acquire()
+    limiter.release()
+    assert limiter.limit == 2.5
+    limiter.acquire()
+    limiter.release("error")
+    assert limiter.limit == 2.5
+    assert limiter.stats() == {"limit": 2.5, "in_flight": 0, "rate_limited": 3}
+
+
+def test_rate_limited_calls_retry_same_model_without_tripping_breaker(cfg, fake, monkeypatch):
+    cfg(keep=("rpm",))
+    sleeps = []
+    monkeypatch.setattr(router.time, "sleep", sleeps.append)
+
+    rate_limited = StatusError(429)
+    rate_limited.response = SimpleNamespace(status_code=429, headers={"retry-after": "0.25"})
+    for _ in range(2):
+        fake["fail"] = {"o4mini": [rate_limited] * 3}  # max_rate_limit_retry
+        assert router.wrap_call("tool_reasoning", "hi") == {"model": "o4mini"}
+    assert fake["calls"] == ["o4mini"] * 8
+    assert sleeps.count(0.25) == 6  # Retry-After, then the same model again
+    assert router._circuit_breaker().state("o4mini") == "closed"
+    assert router.provider_limiter("openai").stats()["rate_limited"] == 6
+    assert router.provider_limiter("openai").limit < 32
+
+    # more 429s than max_rate_limit_retry: fall back, still without opening the circuit
+    fake["calls"].clear()
+    fake["fail"] = {"o4mini": [rate_limited] * 4}
+    assert router.wrap_call("tool_reasoning", "hi") == {"model": "gemini_flash_25"}
+    assert fake["calls"] == ["o4mini"] * 4 + ["gemini_flash_25"]
+    assert router._circuit_breaker()._failures.get("o4mini") is None
+
+
+def test_hedged_calls_record_each_model_and_cache_under_the_winner(cfg, fake):
+    for i in range(20):  # latency samples so claude_sonnet_37 gets hedged
+        router.wrap_call("code", f"warm up {i}")
+
+    # the primary now fails after 50ms and the hedge answers in 10ms
+    fake["latency"] = lambda model: 0.05 if model == "claude_sonnet_37" else 0.01
+    fake["fail"] = {"claude_sonnet_37": StatusError(500)}
+    for i in range(10):
+        assert router.wrap_call("code", f"page {i}", hedge=True, temperature=0) == {"model": "o4mini"}
+    time.sleep(0.1)  # let the background primaries finish
+    assert router._circuit_breaker().state("claude_sonnet_37") == "open"
+    assert router.hedge_budget().hedge_wins >= 1
+
+    cache = router.response_cache()
+    assert cache.lookup([cache.key("o4mini", "page 0", {"temperature": 0})]) == {"model": "o4mini"}
+    assert cache.lookup([cache.key("claude_sonnet_37", "page 0", {"temperature": 0})]) is None
+
+
+def test_timeouts_and_cancelled_trials_release_the_circuit(cfg, fake):
+    cfg(open(router.CONFIG_PATH).read().replace("timeout_sec: 60", "timeout_sec: 0.05"))
+    fake["latency"] = lambda model: 0.2 if model == "gemini_flash_25" else 0.001
+    # the sync genai call has no SDK timeout; the router still gives up after timeout_sec
+    start = time.perf_counter()
+    assert router.wrap_call("rag", "hi") == {"model": "claude_sonnet_35"}
+    assert time.perf_counter() - start < 0.15
+
+    breaker = router._circuit_breaker()
+    breaker._opened_at["o4mini"] = breaker.clock() - breaker.cooldown_sec  # half-open
+    fake["latency"] = lambda model: 0.03
+
+    async def cancelled_trial():
+        request = asyncio.ensure_future(router.wrap_call_async("tool_reasoning", "hi"))
+        await asyncio.sleep(0.01)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+
+    asyncio.run(cancelled_trial())
+    assert breaker.allow("o4mini")  # the trial slot was freed
+
+
+def test_concurrent_identical_calls_share_one_request(cfg, fake):
+    fake["latency"] = lambda model: 0.1
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: router.wrap_call("tool_reasoning", "page 0", temperature=0), range(8)))
+    assert results == [{"model": "o4mini"}] * 8
+    assert fake["calls"] == ["o4mini"]
+    assert router.single_flight().stats() == {"calls": 1, "coalesced": 7, "in_flight": 0}
+
+    async def fan_out():
+        return await asyncio.gather(*[router.wrap_call_async("tool_reasoning", "page 1", temperature=0) for _ in range(5)]
+                                    + [router.wrap_call_async("tool_reasoning", "page 1", temperature=0.7) for _ in range(2)])
+
+    fake["calls"].clear()
+    assert asyncio.run(fan_out()) == [{"model": "o4mini"}] * 7
+    assert len(fake["calls"]) == 3  # sampled calls are never shared
+    assert router.single_flight().stats()["coalesced"] == 11
+
+    # followers get the leader's error, then the next call starts a new flight
+    fake["fail"] = {"o4mini": [StatusError(400)]}
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(router.wrap_call, "tool_reasoning", "page 2", temperature=0) for _ in range(3)]
+    assert all(isinstance(future.exception(), StatusError) for future in futures)
+    assert router.wrap_call("tool_reasoning", "page 2", temperature=0) == {"model": "o4mini"}
+
+
+def test_stream_call_yields_chunks_and_falls_back_before_the_first_one(cfg, fake):
+    assert list(router.stream_call("tool_reasoning", "hi")) == ["streamed ", "o4mini"]
+
+    fake["fail"] = {"claude_sonnet_37": [StatusError(500)]}
+    assert "".join(router.stream_call("code", "hi")) == "streamed o4mini"
+    assert fake["calls"] == ["o4mini", "claude_sonnet_37", "o4mini"]
+
+    # a consumer that stops early frees the provider slot
+    stream = router.stream_call("code", "hi")
+    assert next(stream) == "streamed "
+    stream.close()
+    assert router.provider_limiter("anthropic").stats()["in_flight"] == 0
+
+    async def consume():
+        return [text async for text in router.stream_call_async("code", "hi")]
+
+    assert asyncio.run(consume()) == ["streamed ", "claude_sonnet_37"]
+    assert router.provider_limiter("anthropic").stats()["in_flight"] == 0
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Ensure the repository root is on sys.path so that `codes` and `tasks` are importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import tasks.pdf_to_json as task
+
+
+def test_async_pages_are_cached_even_if_another_page_fails(tmp_path, monkeypatch):
+    pdf = tmp_path / "paper.pdf"
+    pdf.write_bytes(b"%PDF")
+    calls = []
+
+    async def fake_wrap_call_async(task, prompt, temperature):
+        calls.append(prompt["image"])
+        if prompt["image"] == "img1" and calls.count("img1") == 1:
+            raise RuntimeError("provider down")
+        await asyncio.sleep(0)
+        return {"page": prompt["image"]}
+
+    monkeypatch.setattr(task, "pdf_to_images", lambda path: ["img0", "img1", "img2"])
+    monkeypatch.setattr(task, "merge_pages", lambda pages: pages)
+    monkeypatch.setattr(task, "wrap_call_async", fake_wrap_call_async)
+    cache_dir = str(tmp_path / "cache")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(task.pdf_to_json_async(str(pdf), cache_dir))
+    # the re-run only asks for the page that failed
+    pages = asyncio.run(task.pdf_to_json_async(str(pdf), cache_dir))
+    assert pages == [{"page": "img0"}, {"page": "img1"}, {"page": "img2"}]
+    assert sorted(calls) == ["img0", "img1", "img1", "img2"]
@@ -0,0 +1,256 @@
+import os
+import sys
+
+# Ensure the repository root is on sys.path so that `codes` is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import codes.utils as utils
+
+
+def test_extract_imported_modules():
+    code = "import os\nfrom model import Transformer\nfrom . import trainer\n"
+    modules = utils.extract_imported_modules(code)
+    assert "os" in modules
+    assert "model" in modules
+    assert "trainer" in modules
+    assert utils.extract_imported_modules("def broken(:") == []
+
+
+def test_build_dependency_graph():
+    todo_file_lst = ["config.yaml", "dataset_loader.py", "src/model.py", "trainer.py", "main.py"]
+    logic_analysis_dict = {
+        "dataset_loader.py": "Loads the data described in config.yaml.",
+        "src/model.py": "Defines the Transformer.",
+        "trainer.py": "Uses model.py and batches from dataset_loader.",
+        "main.py": "Entry point; calls Trainer from trainer.py.",
+    }
+    graph = utils.build_dependency_graph(todo_file_lst, logic_analysis_dict)
+    assert graph["dataset_loader.py"] == []
+    assert graph["src/model.py"] == []
+    assert graph["trainer.py"] == ["src/model.py"]
+    assert graph["main.py"] == ["trainer.py"]
+
+
+def test_build_dependency_graph_uses_generated_imports_and_ignores_forward_edges():
+    todo_file_lst = ["utils.py", "model.py", "main.py"]
+    logic_analysis_dict = {"utils.py": "Helpers used by main.py"}
+    done_file_dict = {"model.py": "import torch\nfrom utils import set_seed\n"}
+    graph = utils.build_dependency_graph(todo_file_lst, logic_analysis_dict, done_file_dict)
+    assert graph == {"utils.py": [], "model.py": ["utils.py"], "main.py": []}
+
+
+def test_load_generated_code(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "model.py").write_text("from utils import set_seed\n")
+    code_dict = utils.load_generated_code(str(tmp_path), ["utils.py", "src/model.py"])
+    assert code_dict == {"src/model.py": "from utils import set_seed\n"}
+    assert utils.load_generated_code("", ["utils.py"]) == {}
+
+
+def test_get_dependency_levels():
+    graph = {"a.py": [], "b.py": [], "c.py": ["a.py"], "d.py": ["b.py", "c.py"]}
+    assert utils.get_dependency_levels(graph) == [["a.py", "b.py"], ["c.py"], ["d.py"]]
+
+
+def test_extract_design_relations():
+    design = "\nclassDiagram\n    class Main {\n        +run()\n    }\n    class Model {\n        +forward(x: Tensor) -> Tensor\n    }\n    Main --> Trainer\n    Trainer \"1\" *-- \"1\" Model\n"
+    relations = utils.extract_design_relations(design)
+    assert relations["Main"] == {"Trainer"}
+    assert relations["Trainer"] == {"Main", "Model"}
+    assert relations["Model"] == {"Trainer"}
+
+
+def test_code_to_stub():
+    code = (
+        "import torch\n"
+        "SCALE = 2\n"
+        "class Model(Base):\n"
+        "    \"\"\"The model.\"\"\"\n"
+        "    dim: int = 4\n"
+        "    def __init__(self, hidden: int = 8):\n"
+        "        super().__init__()\n"
+        "        self.hidden = hidden\n"
+        "    def forward(self, x: int) -> int:\n"
+        "        \"\"\"Scale x.\"\"\"\n"
+        "        return x * SCALE\n"
+        "def helper(a, b=1):\n"
+        "    return a + b\n"
+    )
+    stub = utils.code_to_stub(code)
+    assert "import torch" in stub
+    assert "SCALE = 2" in stub
+    assert "class Model(Base):" in stub
+    assert "The model." in stub
+    assert "dim: int = 4" in stub
+    assert "def __init__(self, hidden: int=8):" in stub
+    assert "self.hidden = ..." in stub
+    assert "def forward(self, x: int) -> int:" in stub
+    assert "Scale x." in stub
+    assert "def helper(a, b=1):" in stub
+    assert "return" not in stub
+    assert "super()" not in stub
+    assert utils.code_to_stub("def broken(:") == "def broken(:"
+
+
+def test_code_to_stub_is_cached(monkeypatch):
+    code = "def cached_function(x):\n    return x\n"
+    stub = utils.code_to_stub(code)
+    monkeypatch.setattr(utils.ast, "parse", None)
+    assert utils.code_to_stub(code) == stub
+
+
+def test_select_code_context():
+    done_file_dict = {
+        "utils.py": "def set_seed(seed):\n    pass\n",
+        "model.py": "class Model:\n    pass\n",
+        "tokenizer.py": "class Tokenizer:\n    pass\n",
+        "dataset_loader.py": "from tokenizer import Tokenizer\nclass DatasetLoader:\n    pass\n",
+        "evaluation.py": "class Evaluation:\n    pass\n",
+    }
+    done_file_lst = ["config.yaml", "utils.py", "model.py", "tokenizer.py", "dataset_loader.py", "evaluation.py"]
+    relations = {"Trainer": {"Model", "Main"}, "Model": {"Trainer"}}
+    reference_text = "Trainer loops over batches and calls set_seed first."
+    relevant, other = utils.select_code_context(
+        "trainer.py", done_file_lst, done_file_dict, reference_text,
+        dependency_graph={"trainer.py": ["dataset_loader.py"]}, design_relations=relations,
+    )
+    # tokenizer.py comes in through the imports of dataset_loader.py
+    assert relevant == ["utils.py", "model.py", "tokenizer.py", "dataset_loader.py"]
+    assert other == ["evaluation.py"]
+
+
+def test_run_in_waves_with_stub_engine():
+    graph = {"utils.py": [], "model.py": [], "trainer.py": ["model.py"], "main.py": ["utils.py", "trainer.py"]}
+    levels = utils.get_dependency_levels(graph)
+    done = {}
+    batches = []
+
+    def build_msg(file_name):
+        # every dependency must already be generated when the prompt is built
+        assert all(dep in done for dep in graph[file_name])
+        return {"file": file_name, "context": sorted(done)}
+
+    def stub_generate(msg_lst):
+        batches.append([msg["file"] for msg in msg_lst])
+        return [f"code of {msg['file']}" for msg in msg_lst]
+
+    def on_done(file_name, msg, completion):
+        done[file_name] = completion
+
+    utils.run_in_waves(levels, build_msg, stub_generate, on_done)
+    assert batches == [["utils.py", "model.py"], ["trainer.py"], ["main.py"]]
+    assert done["main.py"] == "code of main.py"
+
+
+def test_print_log_cost_and_cache_summary(tmp_path):
+    def completion(prompt_tokens, cached_tokens):
+        return {
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 10,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    completion_json_lst = [completion(1000, 0), completion(1000, 900)]
+    total_cost = 0
+    for completion_json in completion_json_lst:
+        total_cost = utils.print_log_cost(completion_json, "o3-mini", "[ANALYSIS] a.py", str(tmp_path), total_cost)
+    utils.print_log_cache_summary(completion_json_lst, "[ANALYSIS]", str(tmp_path))
+
+    log = (tmp_path / "cost_info.log").read_text(encoding="utf-8")
+    assert "Cache hit ratio: 90.00%" in log
+    assert "Prompt Cache Summary" in log
+    assert "Cache hit ratio: 45.00%" in log
+
+    summary = utils.load_usage_summary(str(tmp_path))
+    assert summary["calls"] == 2
+    assert summary["input_tokens"] == 2000
+    assert summary["cached_tokens"] == 900
+    assert summary["output_tokens"] == 20
+    assert abs(summary["total_cost"] - total_cost) < 1e-12
+
+
+def test_rerunning_a_finished_stage_keeps_the_accumulated_cost(tmp_path):
+    output_dir = str(tmp_path)
+    cost_file = f"{output_dir}/accumulated_cost.json"
+    completion_json = {"choices": [{"message": {"content": "ok"}}],
+                       "usage": {"prompt_tokens": 1000, "completion_tokens": 10, "prompt_tokens_details": {"cached_tokens": 0}}}
+
+    def run_stage(stage, names):
+        # the cost bookkeeping of 1_planning.py, 2_analyzing.py and 3_coding.py
+        other_stage_cost = utils.load_accumulated_cost(cost_file, exclude_stage=stage)
+        total_accumulated_cost = other_stage_cost
+        for name in names:
+            key = utils.get_checkpoint_key("o3-mini", [{"role": "user", "content": f"{stage} {name}"}])
+            completion, is_resumed = utils.run_with_checkpoint(output_dir, key, lambda: completion_json)
+            if is_resumed:
+                total_accumulated_cost += utils.cal_cost(completion, "o3-mini")["total_cost"]
+            else:
+                total_accumulated_cost = utils.print_log_cost(completion, "o3-mini", stage, output_dir, total_accumulated_cost)
+        utils.save_accumulated_cost(cost_file, stage, total_accumulated_cost - other_stage_cost)
+
+    call_cost = utils.cal_cost(completion_json, "o3-mini")["total_cost"]
+    run_stage("planning", ["plan"])
+    run_stage("analyzing", ["a.py", "b.py"])
+    assert abs(utils.load_accumulated_cost(cost_file) - 3 * call_cost) < 1e-12
+    for _ in range(2):
+        run_stage("analyzing", ["a.py", "b.py"])
+        assert abs(utils.load_accumulated_cost(cost_file) - 3 * call_cost) < 1e-12
+    assert set(utils.load_stage_costs(cost_file)) == {"planning", "analyzing"}
+
+
+def test_run_batch_with_checkpoint_only_generates_missing(tmp_path):
+    msg_lst = [[{"role": "user", "content": f"write {name}"}] for name in ["a.py", "b.py", "c.py"]]
+    key_lst = [utils.get_checkpoint_key("model", msg, temperature=0.0) for msg in msg_lst]
+    assert key_lst[0] != utils.get_checkpoint_key("model", msg_lst[0], temperature=1.0)
+
+    calls = []
+    def batch_fn(todo_msg_lst):
+        calls.append(len(todo_msg_lst))
+        return [msg[0]["content"].upper() for msg in todo_msg_lst]
+
+    utils.save_checkpoint(str(tmp_path), key_lst[1], "cached b")
+    result_lst = utils.run_batch_with_checkpoint(str(tmp_path), key_lst, msg_lst, batch_fn)
+    assert result_lst == ["WRITE A.PY", "cached b", "WRITE C.PY"]
+    assert calls == [2]
+
+    result, is_resumed = utils.run_with_checkpoint(str(tmp_path), key_lst[0], lambda: "never called")
+    assert (result, is_resumed) == ("WRITE A.PY", True)
+
+
+def test_stream_chat_completion_writes_artifact_and_code_as_it_arrives(tmp_path):
+    import json
+    from types import SimpleNamespace
+
+    class Chunk:
+        def __init__(self, content=None, usage=None):
+            self.data = {"id": "c1", "created": 1, "model": "o3-mini", "usage": usage,
+                         "choices": [] if content is None else [{"delta": {"content": content}, "finish_reason": None}]}
+
+        def model_dump_json(self):
+            return json.dumps(self.data)
+
+    usage = {"prompt_tokens": 10, "completion_tokens": 5, "prompt_tokens_details": {"cached_tokens": 0}}
+    pieces = ["Here:\n```py", "thon\nimport os\n", "x = 1\n``", "`\nDone"]
+    seen = []
+
+    def create(**request):
+        assert request["stream"] and request["stream_options"] == {"include_usage": True}
+        for piece in pieces:
+            yield Chunk(piece)
+            seen.append((tmp_path / "main.py").read_text())  # the code file grows before the end
+        yield Chunk(usage=usage)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    with utils.ArtifactStream(str(tmp_path / "artifacts" / "main.txt"), str(tmp_path / "main.py")) as stream:
+        completion_json = utils.stream_chat_completion(client, {"model": "o3-mini", "messages": []}, stream.write)
+
+    content = "".join(pieces)
+    assert completion_json["choices"][0]["message"] == {"role": "assistant", "content": content}
+    assert completion_json["usage"] == usage
+    assert (tmp_path / "artifacts" / "main.txt").read_text() == content
+    assert seen[1] == "import os\n"
+    assert (tmp_path / "main.py").read_text() == utils.extract_code_from_content(content)